@@ -0,0 +1,56 @@
+"""
+  
+  Micro-benchmark for the dedupe in ``find`` and ``follow``: how long it takes
+  to check ``n`` candidate tweets against ``n`` existing followings, using the
+  list membership test we used to do and the ``IntSet`` we use now::
+      
+      $ python benchmarks/bench_dedupe.py 1000 10000 50000
+  
+  
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from tastytweets.intset import IntSet
+
+
+def dedupe_with_list(existing, candidates):
+    existing = list(existing)
+    for userid in candidates:
+        if not userid in existing:
+            existing.append(userid)
+
+
+def dedupe_with_intset(existing, candidates):
+    existing = IntSet(existing)
+    for userid in candidates:
+        if not userid in existing:
+            existing.add(userid)
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main(sizes):
+    print '%10s %12s %12s' % ('n', 'list (s)', 'intset (s)')
+    for n in sizes:
+        existing = random.sample(xrange(n * 10), n)
+        candidates = [random.randrange(n * 10) for i in xrange(n)]
+        print '%10d %12.4f %12.4f' % (
+            n,
+            timed(dedupe_with_list, existing, candidates),
+            timed(dedupe_with_intset, existing, candidates)
+        )
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000])
+
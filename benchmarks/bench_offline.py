@@ -0,0 +1,358 @@
+"""
+  
+  Offline benchmark for ``find``, ``follow`` and ``push``: starts a local http
+  server standing in for delicious, backtweets and twitter, points the
+  ``tastytweets.client`` urls at it and times each phase against synthetic
+  data::
+      
+      $ python benchmarks/bench_offline.py --urls 100 --tweets 250 --followings 5000
+          
+          phase     wall (s)   requests     errors   peak rss (MB)
+           find       2.4978        301          0            16.8
+         follow       2.7669        302          0            23.3
+           push      17.3647       5000          0            12.6
+  
+  Each url has ``--tweets`` tweets on backtweets, from a pool of users that
+  overlaps the ``--followings`` users we already follow.  The delicious feed
+  returns at most ``count`` urls, as the real one did.  Use ``--latency`` to
+  slow every response down and ``--error-rate`` to make that fraction of the
+  requests to the ``--error-endpoints`` fail with a 503.
+  
+  The server runs in a forked process, and so does each phase, so a phase's
+  peak rss is its own (and not the fake data's).  Each phase works from the
+  state and queue the phase before it left on disk.
+  
+  
+"""
+
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+import urlparse
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from optparse import OptionParser
+from resource import getrusage, RUSAGE_SELF
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from tastytweets import client
+
+
+ENDPOINTS = ('delicious', 'backtweets', 'following', 'follow')
+
+PHASES = ('find', 'follow', 'push')
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    
+    protocol_version = 'HTTP/1.1'
+    # buffer the status line and headers, rather than sending them a line
+    # at a time, which stalls each keep-alive response on nagle and delayed
+    # acks for ~40ms
+    wbufsize = -1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    
+    def _endpoint(self, path):
+        if path.startswith('/v2/json/'):
+            return 'delicious'
+        if path == '/search.json':
+            return 'backtweets'
+        if path.startswith('/friends/ids/'):
+            return 'following'
+        if path.startswith('/friendships/create/'):
+            return 'follow'
+        return None
+    
+    def _respond(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+    
+    def _handle(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+        path, query = urlparse.urlsplit(self.path)[2:4]
+        params = dict(urlparse.parse_qsl(query))
+        data = self.server.data
+        if path == '/counts':
+            # for the benchmark, rather than the client
+            return self._respond(200, json.dumps(data.counts))
+        endpoint = self._endpoint(path)
+        data.count(endpoint)
+        if data.latency:
+            time.sleep(data.latency)
+        if endpoint is None:
+            return self._respond(404, '{}')
+        if endpoint in data.error_endpoints and data.random.random() < data.error_rate:
+            data.count('errors')
+            return self._respond(503, '{}')
+        if endpoint == 'delicious':
+            body = data.get_bookmarks(int(params.get('count', 100)))
+        elif endpoint == 'backtweets':
+            body = data.get_tweets(
+                params['q'],
+                int(params.get('since_id', 0)),
+                int(params.get('page', 1)),
+                int(params.get('itemsperpage', 100))
+            )
+        elif endpoint == 'following':
+            body = data.get_following()
+        else:
+            body = '{}'
+        self._respond(200, body)
+    
+    
+    def do_GET(self):
+        self._handle()
+    
+    def do_POST(self):
+        self._handle()
+
+
+
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def handle_error(self, request, client_address):
+        # e.g.: a phase's process exiting with its connections still open
+        pass
+
+
+
+
+
+class FakeData(object):
+    """
+      
+      The synthetic bookmarks, tweets and followings the ``FakeServer``
+      serves, and the no. of requests it's had to each endpoint.
+      
+      
+    """
+    
+    def count(self, endpoint):
+        self._lock.acquire()
+        try:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+        finally:
+            self._lock.release()
+    
+    def get_bookmarks(self, count):
+        return json.dumps([{'u': url} for url in self.urls[:count]])
+    
+    def get_tweets(self, url, since_id, page, per_page):
+        i = self.url_indexes.get(url)
+        if i is None:
+            return json.dumps({'tweets': []})
+        # the newest tweets first, with ids that don't overlap between urls
+        base = (i + 1) * 1000000
+        ids = [base + j for j in xrange(self.tweets, 0, -1) if base + j > since_id]
+        tweets = []
+        for tweet_id in ids[(page - 1) * per_page:page * per_page]:
+            # spread the urls' tweets over the pool
+            user_id = ((i * self.tweets + tweet_id - base) * 7919) % self.pool
+            tweets.append({
+                    'tweet_id': tweet_id,
+                    'tweet_from_user_id': user_id,
+                    'tweet_from_user': 'user%d' % user_id
+                }
+            )
+        return json.dumps({'tweets': tweets})
+    
+    def get_following(self):
+        return self.following
+    
+    
+    def __init__(self, urls, tweets, followings, latency=0, error_rate=0, error_endpoints=('follow',)):
+        self.urls = ['http://site%d.example.com/page' % i for i in xrange(urls)]
+        self.url_indexes = dict([(url, i) for i, url in enumerate(self.urls)])
+        self.tweets = tweets
+        # the tweets come from a pool of users half of whom we already follow
+        self.pool = max(followings * 2, 1)
+        self.following = json.dumps(range(followings))
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_endpoints = error_endpoints
+        self.random = random.Random(0)
+        self.counts = {}
+        self._lock = threading.Lock()
+
+
+
+
+
+def read_pipe(fd):
+    chunks = []
+    chunk = os.read(fd, 4096)
+    while chunk:
+        chunks.append(chunk)
+        chunk = os.read(fd, 4096)
+    os.close(fd)
+    return ''.join(chunks)
+
+
+def start_server(options):
+    # serve from a child process, so the fake data isn't in the memory the
+    # phases are forked with; returns the server's ``(pid, base_url)``
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        try:
+            server = FakeServer(('127.0.0.1', 0), FakeHandler)
+            server.data = FakeData(
+                options.urls,
+                options.tweets,
+                options.followings,
+                latency = options.latency / 1000.0,
+                error_rate = options.error_rate,
+                error_endpoints = options.error_endpoints.split(' ')
+            )
+            os.write(write_fd, str(server.server_address[1]))
+            os.close(write_fd)
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    port = int(read_pipe(read_fd))
+    return pid, 'http://127.0.0.1:%d' % port
+
+
+def get_counts(base_url):
+    # returns ``(requests, errors)`` the server's had so far
+    counts = json.load(urllib2.urlopen('%s/counts' % base_url))
+    errors = counts.pop('errors', 0)
+    return sum(counts.values()), errors
+
+
+def point_client_at(base_url):
+    client.BACKTWEETS_URL = u'%s/search.json' % base_url
+    client.DELICIOUS_URL = u'%s/v2/json/%%s/%%s?count=100' % base_url
+    client.TWITTER_FOLLOWING_URL = u'%s/friends/ids/%%s.json' % base_url
+    client.TWITTER_FOLLOW_URL = u'%s/friendships/create/%%s.json?follow=true' % base_url
+
+
+def run_phase(phase, options, work_dir):
+    # find in a state of its own, so follow starts from scratch
+    status_data = phase == 'find' and 'find-status.db' or 'status.db'
+    tt = client.TastyTweeter(
+        twitter_user = 'bench',
+        twitter_pwd = 'bench',
+        backtweets_key = 'bench',
+        status_data = os.path.join(work_dir, status_data),
+        queue_dir = os.path.join(work_dir, 'queue'),
+        cache_dir = os.path.join(work_dir, 'cache'),
+        concurrency = options.concurrency,
+        max_pages = options.max_pages,
+        budget = options.budget,
+        segment_queue = options.segment_queue
+    )
+    if phase == 'find':
+        tt.find()
+    elif phase == 'follow':
+        tt.follow()
+    else:
+        tt.get_backoff(client.TWITTER_FOLLOW_URL).base = options.backoff
+        tt.drain(rate_limit=sys.maxint)
+
+
+def time_phase(phase, options, work_dir):
+    # run the phase in a child process, so we get its own peak rss
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        status = 0
+        result = {}
+        try:
+            try:
+                started = time.time()
+                run_phase(phase, options, work_dir)
+                result['wall'] = time.time() - started
+            except Exception, e:
+                result['error'] = '%s: %s' % (e.__class__.__name__, e)
+                status = 1
+            result['maxrss'] = getrusage(RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, json.dumps(result))
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    result = read_pipe(read_fd)
+    os.waitpid(pid, 0)
+    return json.loads(result)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--urls", type="int", dest="urls", default=100)
+    parser.add_option("--tweets", type="int", dest="tweets", default=250,
+        help="no. of tweets on backtweets for each url")
+    parser.add_option("--followings", type="int", dest="followings", default=5000,
+        help="no. of users we already follow")
+    parser.add_option("--latency", type="float", dest="latency", default=0,
+        help="no. of milliseconds to add to each response")
+    parser.add_option("--error-rate", type="float", dest="error_rate", default=0,
+        help="fraction of the requests to the --error-endpoints to fail")
+    parser.add_option("--error-endpoints", type="string", dest="error_endpoints", default='follow',
+        help="space separated, out of: %s" % ' '.join(ENDPOINTS))
+    parser.add_option("--backoff", type="float", dest="backoff", default=0,
+        help="no. of seconds push backs off for after its first error")
+    parser.add_option("-c", "--concurrency", type="int", dest="concurrency", default=client.CONCURRENCY)
+    parser.add_option("--max-pages", type="int", dest="max_pages", default=client.MAX_PAGES)
+    parser.add_option("--budget", type="int", dest="budget", default=client.BUDGET)
+    parser.add_option("--segment-queue", action="store_true", dest="segment_queue", default=False)
+    (options, args) = parser.parse_args()
+    
+    server_pid, base_url = start_server(options)
+    point_client_at(base_url)
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        print '%10s %12s %10s %10s %15s' % ('phase', 'wall (s)', 'requests', 'errors', 'peak rss (MB)')
+        for phase in PHASES:
+            requests, errors = get_counts(base_url)
+            result = time_phase(phase, options, work_dir)
+            if 'error' in result:
+                print '%10s failed: %s' % (phase, result['error'])
+                continue
+            total_requests, total_errors = get_counts(base_url)
+            print '%10s %12.4f %10d %10d %15.1f' % (
+                phase,
+                result['wall'],
+                total_requests - requests,
+                total_errors - errors,
+                result['maxrss'] / 1024.0
+            )
+    finally:
+        os.kill(server_pid, signal.SIGTERM)
+        os.waitpid(server_pid, 0)
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
+
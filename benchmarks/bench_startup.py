@@ -0,0 +1,77 @@
+"""
+  
+  Startup benchmark for ``tastytweets-push``, which cron runs every few
+  minutes and which usually finds the queue empty: how long it takes to start
+  python, to import ``tastytweets.client`` and to push from an empty queue,
+  with and without the mark the last push leaves when it finds it empty::
+      
+      $ python benchmarks/bench_startup.py 20
+  
+  Each is run ``n`` times in a fresh process and the min and median times are
+  reported.
+  
+  
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+sys.path.insert(0, SRC_DIR)
+
+from tastytweets.client import EMPTY_MARK
+
+
+PUSH = """
+import sys
+sys.argv = ['tastytweets-push', '-u', 'bench', '-p', 'bench', '-q', %r]
+from tastytweets.client import push
+push()
+"""
+
+
+def timed_run(code, env):
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', code], env=env)
+    return time.time() - start
+
+
+def main(n):
+    queue_dir = tempfile.mkdtemp()
+    mark_path = os.path.join(queue_dir, EMPTY_MARK)
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([SRC_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    def unmark():
+        if os.path.exists(mark_path):
+            os.remove(mark_path)
+    def mark():
+        open(mark_path, 'w').close()
+    
+    runs = [
+        ('python', 'pass', None),
+        ('import client', 'import tastytweets.client', None),
+        ('push, empty', PUSH % queue_dir, unmark),
+        ('push, marked', PUSH % queue_dir, mark)
+    ]
+    try:
+        print '%15s %10s %12s' % ('', 'min (ms)', 'median (ms)')
+        for name, code, setup in runs:
+            times = []
+            for i in xrange(n):
+                if setup is not None:
+                    setup()
+                times.append(timed_run(code, env) * 1000)
+            times.sort()
+            print '%15s %10.1f %12.1f' % (name, times[0], times[len(times) / 2])
+    finally:
+        shutil.rmtree(queue_dir)
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 10)
+
@@ -50,6 +50,9 @@ setup(
             'tastytweets-find = tastytweets.client:find',
             'tastytweets-follow = tastytweets.client:follow',
             'tastytweets-push = tastytweets.client:push',
+            'tastytweets-drain = tastytweets.client:drain',
+            'tastytweets-multi = tastytweets.client:multi',
+            'tastytweets-daemon = tastytweets.client:daemon',
             'tastytweets-automate = tastytweets.client:automate',
             'tastytweets-reset-everything = tastytweets.client:reset',
             'tastytweets-reset-status-id = tastytweets.client:reset_status_id'
@@ -1 +1 @@
-from client import TastyTweeter, find, follow, push, reset
\ No newline at end of file
+from client import TastyTweeter, find, follow, push, drain, reset
\ No newline at end of file
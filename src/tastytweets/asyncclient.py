@@ -0,0 +1,241 @@
+import threading
+import urlparse
+
+from Queue import Queue
+
+from client import TastyTweeter, BACKTWEETS_URL, DELICIOUS_URL, TWITTER_FOLLOWING_URL
+
+
+class AsyncTastyTweeter(TastyTweeter):
+    """
+      
+      A ``TastyTweeter`` whose ``find`` and ``follow`` don't wait for one
+      phase to finish before starting the next: the delicious feed, the full
+      list of who the twitter account is following (when it's due, see
+      ``sync_following``) and the backtweets lookups of the urls already in
+      the index all start at once, and the urls the feed adds are looked up
+      as soon as it's come in.  So a run takes about as long as its slowest
+      requests, rather than all of them end to end::
+          
+          >>> tt = AsyncTastyTweeter(
+          ...     backtweets_key = my_backtweets_key,
+          ...     delicious_user = my_delicious_user,
+          ...     host_limits = {'backtweets.com': 8}
+          ... )
+          >>> tt.find()
+          [...]
+      
+      It takes the same init params as a ``TastyTweeter``, plus
+      ``host_limits``, the max no. of requests in flight to each host, by
+      host name.  A host that isn't listed gets ``concurrency``.
+      
+      It reads and writes the same status data and queue as a
+      ``TastyTweeter``, so the two can be swapped for each other between
+      runs.  The requests are made from threads, but the status data is only
+      used from the thread that called ``find`` or ``follow``, which deals
+      with the responses in whatever order they come in.
+      
+      
+    """
+    
+    def _get_host_limit(self, url):
+        host = urlparse.urlsplit(url).hostname
+        return max(self.host_limits.get(host, self.concurrency), 1)
+    
+    def _get_host_semaphore(self, url):
+        host = urlparse.urlsplit(url).hostname
+        self._lock.acquire()
+        try:
+            if not host in self._host_semaphores:
+                self._host_semaphores[host] = threading.Semaphore(self._get_host_limit(url))
+            return self._host_semaphores[host]
+        finally:
+            self._lock.release()
+    
+    def _call(self, url, func, *args):
+        # calls ``func(*args)``, which talks to ``url``'s host, once the host
+        # has a request to spare, returning ``(result, error)``
+        semaphore = self._get_host_semaphore(url)
+        semaphore.acquire()
+        try:
+            try:
+                return func(*args), None
+            except Exception, e:
+                return None, e
+        finally:
+            semaphore.release()
+    
+    
+    def _start(self, kind, url, func, *args):
+        # calls ``func`` in a thread of its own, which puts ``(kind, result,
+        # error)`` on the run's events when it's done
+        def run():
+            result, error = self._call(url, func, *args)
+            self._events.put((kind, result, error))
+        self._tasks.add(kind)
+        thread = threading.Thread(target=run)
+        thread.setDaemon(True)
+        thread.start()
+    
+    
+    def sync_sites(self, due=False):
+        """
+          
+          During a ``find`` or ``follow``, starts downloading the delicious
+          feed and returns the urls already in the index.  The bookmarks are
+          added to the index when the feed comes in (see
+          ``_get_tweets_for_sites``).  Otherwise, the same as
+          ``TastyTweeter.sync_sites``.
+          
+          
+        """
+        if self._events is None:
+            return TastyTweeter.sync_sites(self, due=due)
+        self._due = due
+        self._start('feed', DELICIOUS_URL, self.get_bookmarks, self.delicious_user, self.tags)
+        return self.get_indexed_sites(due=due)
+    
+    def sync_following(self):
+        """
+          
+          During a ``follow``, starts downloading the full list of who
+          ``self.twitter_user`` is following, if it's due, which is merged
+          when it comes in.  Otherwise, the same as
+          ``TastyTweeter.sync_following``.
+          
+          
+        """
+        if self._events is None or not self._is_reconcile_due():
+            return TastyTweeter.sync_following(self)
+        self._start('following', TWITTER_FOLLOWING_URL, self._download_following)
+    
+    
+    def _get_tweets_for_sites(self, urls):
+        """
+          
+          Yields ``(url, tweets)`` for each of the ``urls``, and each url the
+          feed adds to the index that's due a check, as their responses come
+          in, with up to the backtweets host's limit of urls being fetched at
+          once.  The feed and the list of who we're following are dealt with
+          as they come in too, but the urls are held back until the list's
+          been merged, so ``follow`` checks the users against it.
+          
+          As with ``TastyTweeter._get_tweets_for_sites``, a failed request is
+          raised and the run's budget is shared out between the urls in the
+          order they're started, leaving out the ones it doesn't stretch to.
+          
+          
+        """
+        if self._events is None:
+            return TastyTweeter._get_tweets_for_sites(self, urls)
+        return self._get_tweets_as_they_come(urls)
+    
+    def _get_tweets_as_they_come(self, urls):
+        jobs = Queue()
+        started = set()
+        def start(urls):
+            count = 0
+            urls = [url for url in urls if not url in started]
+            # the budget is shared out in the order the urls are started, from
+            # this thread, rather than to whichever worker asks first
+            for url, pages in self._plan_pages(urls):
+                started.add(url)
+                if pages == 0:
+                    # the budget doesn't stretch to it
+                    continue
+                # the state store is only used from this thread, so we look
+                # up the status ids here rather than in the workers
+                jobs.put((url, self._get_site_cursor(url), pages))
+                count += 1
+            return count
+        def fetch(url, since_id, page, progress, pages):
+            return list(self._fetch_tweets_for_site(url, since_id, page, progress, pages))
+        def worker():
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                url, cursor, pages = job
+                progress = {}
+                since_id, page, latest = cursor
+                tweets, error = self._call(BACKTWEETS_URL, fetch, url, since_id, page, progress, pages)
+                self._events.put(('site', (url, cursor, tweets, progress), error))
+        
+        outstanding = start(urls)
+        workers = []
+        for i in range(self._get_host_limit(BACKTWEETS_URL)):
+            thread = threading.Thread(target=worker)
+            thread.setDaemon(True)
+            thread.start()
+            workers.append(thread)
+        held = []
+        try:
+            while self._tasks or outstanding:
+                kind, result, error = self._events.get()
+                if error is not None:
+                    raise error
+                if kind == 'site':
+                    outstanding -= 1
+                    if not result[3].get('unchecked'):
+                        held.append(result)
+                    # otherwise we didn't get to search for it
+                else:
+                    self._tasks.remove(kind)
+                    if kind == 'feed':
+                        self._index_bookmarks(result)
+                        added = [
+                            url for url in self.get_indexed_sites(due=self._due)
+                            if not url in started
+                        ]
+                        self.urls.extend(added)
+                        outstanding += start(added)
+                    elif kind == 'following':
+                        self._merge_following(result)
+                if not 'following' in self._tasks:
+                    while held:
+                        url, cursor, tweets, progress = held.pop(0)
+                        yield url, self._track_site_status_id(url, tweets, cursor, progress)
+        finally:
+            for thread in workers:
+                jobs.put(None)
+        
+    
+    def _run(self, method):
+        # the events of a run are only kept for as long as it lasts, so a
+        # run that falls over doesn't leave anything behind for the next
+        self._events = Queue()
+        self._tasks = set()
+        try:
+            return method(self)
+        finally:
+            self._events = None
+    
+    
+    def find(self):
+        """
+          
+          As ``TastyTweeter.find``, with the requests overlapping.
+          
+          
+        """
+        return self._run(TastyTweeter.find)
+    
+    def follow(self):
+        """
+          
+          As ``TastyTweeter.follow``, with the requests overlapping.
+          
+          
+        """
+        return self._run(TastyTweeter.follow)
+    
+    
+    def __init__(self, *args, **kwargs):
+        self.host_limits = kwargs.pop('host_limits', None) or {}
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+        self._events = None
+        self._tasks = set()
+        self._due = False
+        TastyTweeter.__init__(self, *args, **kwargs)
+
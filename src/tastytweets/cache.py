@@ -0,0 +1,107 @@
+import hashlib
+import os
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+MAX_AGE = 7 * 24 * 60 * 60 # seconds
+MAX_SIZE = 10 * 1024 * 1024 # bytes
+
+
+class ResponseCache(object):
+    """
+      
+      On disk cache of parsed http responses, with the ``ETag`` and
+      ``Last-Modified`` headers they came with, so they can be revalidated
+      with a conditional GET rather than downloaded again::
+          
+          >>> cache = ResponseCache('/tmp/cache')
+          >>> cache.set(url, ['http://a.com'], etag='"abc"')
+          >>> cache.get(url)['data']
+          ['http://a.com']
+          >>> cache.conditional_headers(cache.get(url))
+          {'If-None-Match': '"abc"'}
+      
+      Each response is a file in ``cache_dir``.  Entries older than ``max_age``
+      seconds are ignored and, when ``evict`` runs, removed along with the
+      least recently stored ones until the cache fits in ``max_size`` bytes.
+      
+      
+    """
+    
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+    
+    
+    def get(self, url):
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        sock = open(path, 'r')
+        try:
+            entry = json.load(sock)
+        except ValueError:
+            entry = None
+        sock.close()
+        if entry is None or time.time() - entry['stored'] > self.max_age:
+            return None
+        return entry
+    
+    def set(self, url, data, etag=None, last_modified=None):
+        entry = {
+            'url': url,
+            'data': data,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored': time.time()
+        }
+        # write to a temp file and move it into place, so readers never
+        # see a half written entry
+        path = self._path(url)
+        tmp_path = '%s.tmp' % path
+        sock = open(tmp_path, 'w')
+        json.dump(entry, sock)
+        sock.close()
+        os.rename(tmp_path, path)
+        self.evict()
+    
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        
+        return headers
+    
+    
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            if now - stat.st_mtime > self.max_age:
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        
+        total = sum([size for mtime, size, path in entries])
+        entries.sort()
+        while total > self.max_size and entries:
+            mtime, size, path = entries.pop(0)
+            os.remove(path)
+            total -= size
+    
+    
+    def __init__(self, cache_dir, max_age=MAX_AGE, max_size=MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_size = max_size
+        if not os.path.exists(self.cache_dir):
+            os.mkdir(self.cache_dir)
@@ -1,28 +1,243 @@
 import os
 import shutil
+import time
 
 from directory_queue.directory_queue import DirectoryQueue
 
+from leases import LEASE_TIME, LOCK_FILE, QueueLock, new_lease, read_lease, write_lease
+
+
+LEASE_FILE = 'lease' # in the directory of each claimed item
+
 
 class ClearableDirectoryQueue(DirectoryQueue):
+    """
+      
+      A ``DirectoryQueue`` that can be cleared of its done and failed items
+      and can count the items in each of its states.
+      
+      Clearing a state moves its directory aside to a ``trash`` directory in
+      one rename, rather than deleting the items one by one there and then.
+      The trash is deleted by ``purge``, which can be given a time limit and
+      carries on where it left off the next time it's called.
+      
+      ``getNext`` claims an item with a lease of ``lease_time`` seconds, under
+      a lock on the queue, so several processes can push from it at once.  An
+      item whose lease has run out (because the process that claimed it died
+      or hung) is handed out again, and once that's happened, the changes the
+      process that let it run out makes to it are dropped.
+      
+      
+    """
     
-    def clearDone(self):
-        dirlist = os.listdir(self.queues['done'])
-        for item in dirlist:
-            item_path = os.path.join(self.queues['done'], item)
-            shutil.rmtree(item_path)
-        
+    def _lease_path(self, queue_item):
+        return os.path.join(os.path.dirname(queue_item.dataFileName()), LEASE_FILE)
     
-    def clearError(self):
-        dirlist = os.listdir(self.queues['error'])
-        for item in dirlist:
-            item_path = os.path.join(self.queues['error'], item)
-            shutil.rmtree(item_path)
+    def _holds_lease(self, queue_item):
+        lease = getattr(queue_item, 'lease', None)
+        if lease is None:
+            # e.g.: a new item, which isn't handed out yet
+            return True
+        current = read_lease(self._lease_path(queue_item))
+        return current is not None and current[0] == lease[0]
+    
+    def _recover(self):
+        now = time.time()
+        active_dir = self.queues['active']
+        for name in os.listdir(active_dir):
+            item_path = os.path.join(active_dir, name)
+            lease_path = os.path.join(item_path, LEASE_FILE)
+            lease = read_lease(lease_path)
+            if lease is None:
+                # claimed by a version that didn't take out leases
+                expires = os.path.getmtime(item_path) + self.lease_time
+            else:
+                expires = lease[1]
+            if expires < now:
+                if lease is not None:
+                    os.remove(lease_path)
+                os.rename(item_path, os.path.join(self.queues['ready'], name))
+            
         
     
+    def _finish(self, finish, queue_item):
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            if self._holds_lease(queue_item):
+                if getattr(queue_item, 'lease', None) is not None:
+                    os.remove(self._lease_path(queue_item))
+                    queue_item.lease = None
+                finish(self, queue_item)
+        finally:
+            lock.release()
+    
+    
+    def put(self, name, data):
+        queue_item = self.newQueueItem(name)
+        self.setData(queue_item, data)
+        self.itemReady(queue_item)
+    
+    def getNext(self):
+        """
+          
+          Claims the next ready item, first handing out again any items whose
+          leases have run out.  Returns ``None`` if there isn't one.
+          
+          
+        """
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            self._recover()
+            queue_item = DirectoryQueue.getNext(self)
+            if queue_item:
+                queue_item.lease = new_lease(self.lease_time)
+                write_lease(self._lease_path(queue_item), queue_item.lease)
+            return queue_item
+        finally:
+            lock.release()
+    
+    def getData(self, queue_item):
+        sock = open(queue_item.dataFileName(), 'r')
+        data = sock.read()
+        sock.close()
+        return data
+    
+    def setData(self, queue_item, data):
+        if not self._holds_lease(queue_item):
+            return
+        sock = open(queue_item.dataFileName(), 'w')
+        sock.write(data)
+        sock.close()
+    
+    
+    def itemDone(self, queue_item):
+        self._finish(DirectoryQueue.itemDone, queue_item)
+    
+    def itemRequeue(self, queue_item):
+        self._finish(DirectoryQueue.itemRequeue, queue_item)
     
-    def clear(self):
+    def itemError(self, queue_item):
+        self._finish(DirectoryQueue.itemError, queue_item)
+    
+    
+    def _trash_dir(self):
+        base_dir = os.path.dirname(os.path.normpath(self.queues['done']))
+        trash_dir = os.path.join(base_dir, 'trash')
+        if not os.path.exists(trash_dir):
+            os.mkdir(trash_dir)
+        return trash_dir
+    
+    def _new_trash_path(self, state):
+        name = '%s-%d-%d' % (state, time.time() * 1000, os.getpid())
+        return os.path.join(self._trash_dir(), name)
+    
+    def _clear(self, state, max_age=None, keep=None):
+        # under the lock, so no push finishes an item into the directory
+        # while it's being swapped out
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            self._clear_items(state, max_age, keep)
+        finally:
+            lock.release()
+    
+    def _clear_items(self, state, max_age, keep):
+        state_dir = self.queues[state]
+        if max_age is None and keep is None:
+            # swap in an empty directory
+            os.rename(state_dir, self._new_trash_path(state))
+            os.mkdir(state_dir)
+            return
+        # otherwise just move the items we don't want to keep
+        items = []
+        for item in os.listdir(state_dir):
+            item_path = os.path.join(state_dir, item)
+            items.append((os.path.getmtime(item_path), item_path))
+        items.sort()
+        items.reverse()
+        if keep is None:
+            keep = len(items)
+        cutoff = max_age is not None and time.time() - max_age or None
+        trash_path = None
+        for i, (mtime, item_path) in enumerate(items):
+            if i >= keep or cutoff is not None and mtime < cutoff:
+                if trash_path is None:
+                    trash_path = self._new_trash_path(state)
+                    os.mkdir(trash_path)
+                os.rename(item_path, os.path.join(trash_path, os.path.basename(item_path)))
+    
+    
+    def clearDone(self, max_age=None, keep=None):
+        """
+          
+          Clears the done items, or, if given, just those older than ``max_age``
+          seconds and those past the newest ``keep`` items.  The items are
+          deleted by ``purge``.
+          
+          
+        """
+        self._clear('done', max_age=max_age, keep=keep)
+    
+    def clearError(self, max_age=None, keep=None):
+        self._clear('error', max_age=max_age, keep=keep)
+    
+    def purge(self, max_seconds=None):
+        """
+          
+          Deletes the cleared items, stopping after ``max_seconds`` if given.
+          Returns ``True`` if there's nothing left to delete.  Holds the lock
+          on the queue while it does, so pushes wait for it (at most
+          ``max_seconds``).
+          
+          
+        """
+        started = time.time()
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            trash_dir = self._trash_dir()
+            for name in sorted(os.listdir(trash_dir)):
+                trash_path = os.path.join(trash_dir, name)
+                for item in os.listdir(trash_path):
+                    if max_seconds is not None and time.time() - started > max_seconds:
+                        return False
+                    shutil.rmtree(os.path.join(trash_path, item))
+                os.rmdir(trash_path)
+            
+            return True
+        finally:
+            lock.release()
+    
+    
+    def clear(self, max_seconds=None):
         self.clearDone()
         self.clearError()
+        return self.purge(max_seconds=max_seconds)
+    
+    def stats(self):
+        """
+          
+          Returns a dict of the no. of items in each state.  Each item is a
+          directory, so on filesystems that count a directory's subdirectories
+          in its link count, this is one ``stat`` per state, rather than
+          listing every item.
+          
+          
+        """
+        stats = {}
+        for state, state_dir in self.queues.items():
+            nlink = os.stat(state_dir).st_nlink
+            if nlink >= 2:
+                stats[state] = nlink - 2
+            else:
+                stats[state] = len(os.listdir(state_dir))
+        return stats
+    
     
+    def __init__(self, path, item_class, lease_time=LEASE_TIME):
+        DirectoryQueue.__init__(self, path, item_class)
+        self.lease_time = lease_time
+        self.lock_path = os.path.join(path, LOCK_FILE)
 
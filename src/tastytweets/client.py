@@ -1,12 +1,8 @@
 import base64
-import crontab
 import os
-import pickle
 import shutil
 import sys
 import time
-import urllib
-import urllib2
 
 try:
     import json
@@ -17,7 +13,18 @@ from datetime import datetime
 
 from directory_queue.generic_queue_item import GenericQueueItem
 
+from cache import ResponseCache
 from clearablequeue import ClearableDirectoryQueue
+from intset import IntSet
+from jobs import new_job, encode_job, decode_job
+from jsonstream import iter_array, read_int_array
+from leases import LOCK_FILE, QueueLock
+from metrics import InstrumentedQueue, NullMetrics
+from ratelimit import Backoff, CallBudget, TokenBucket
+from segmentqueue import SegmentQueue
+
+# n.b.: the http, threading, sqlite and crontab modules are imported where
+# they're used, so the scripts start quickly when there's nothing to do
 
 
 BACKTWEETS_URL = u'http://backtweets.com/search.json'
@@ -28,6 +35,11 @@ TWITTER_FOLLOWING_URL = u'https://twitter.com/friends/ids/%s.json'
 TWITTER_FOLLOW_URL = u'https://twitter.com/friendships/create/%s.json?follow=true'
 
 STATUS_DATA = os.path.expanduser(
+    '~/.tastytweets-status.db'
+)
+
+# where versions up to 0.2.2 pickled the status data
+LEGACY_STATUS_DATA = os.path.expanduser(
     '~/.tastytweets-statusdata.pkl'
 )
 
@@ -39,9 +51,40 @@ QUEUE_DIR = os.path.expanduser(
     '~/.tastytweets-queue'
 )
 
+CACHE_DIR = os.path.expanduser(
+    '~/.tastytweets-cache'
+)
+
 FOLLOW_DELAY = 6 # hours
 PUSH_DELAY = 5 # minutes
 
+RATE_LIMIT = 100 # twitter requests per hour
+
+PERMANENT_ERRORS = (404,) # follow requests twitter won't ever accept
+# what twitter says when it refuses a follow request (with a 403) for good,
+# rather than because we've hit the follow limit for now
+ALREADY_FOLLOWING_ERRORS = ('already on your list', 'already following')
+BLOCKED_ERRORS = ('blocked',)
+MAX_ERRORS = 3 # times we retry a follow request
+
+CLEANUP_TIME = 10 # seconds
+
+EMPTY_MARK = 'empty' # file in the queue directory while the queue is empty
+# file in the queue directory listing who pushes have followed or given up on
+FOLLOWED_LOG = 'followed'
+
+RECONCILE_DELAY = 7 * 24 # hours between downloading the full list of who we follow
+
+CONCURRENCY = 4 # simultaneous backtweets requests
+
+ITEMS_PER_PAGE = 100 # backtweets results per request
+MAX_PAGES = 10 # backtweets requests per url per run
+BUDGET = 0 # backtweets requests per run, 0 for no limit
+
+COLD_DELAY = 12 # hours before checking a url that found no one again
+MAX_COLD_DELAY = 8 * 24 # hours
+HIT_RATE_WEIGHT = 0.5 # of the latest check in a url's hit rate
+
 
 class TastyTweeter(object):
     """
@@ -60,11 +103,48 @@ class TastyTweeter(object):
       
       - ``tags`` list of delicious tags to filter the urls by, defaults to ['follow']
       
-      - ``status_data`` filesystem path to the (auto generated) status data file
+      - ``status_data`` filesystem path to the (auto generated) status data file,
+        a SQLite database; the pickle file used by previous versions is migrated
+        into it automatically
+      
+      - ``state_store`` use this ``tastytweets.state.StateStore`` instead of the
+        database at ``status_data``
+      
+      - ``transport`` the ``tastytweets.transport.Transport`` to make http requests
+        with, defaults to an ``HTTPTransport``, which keeps connections alive
+      
+      - ``cache_dir`` filesystem path to the (auto generated) directory where the
+        delicious feed is cached between runs, or ``None`` not to cache it
       
       - ``queue_dir`` filesystem path to the (auto generated) queue directory which
         persists stored up follow requests to be pushed on a regular basis
       
+      - ``segment_queue`` if true, store the queued follow requests many to a
+        file, in a ``SegmentQueue``, rather than a directory each
+      
+      - ``lookup_cache`` a ``tastytweets.lookups.LookupCache`` to share backtweets
+        search results with other ``TastyTweeter``s
+      
+      - ``concurrency`` the max no. of urls to query backtweets for at once,
+        defaults to 4; use 1 to query the urls one at a time
+      
+      - ``max_pages`` the max no. of pages of backtweets results to read for each
+        url per run, defaults to 10; if a url has more tweets than that, the
+        next run carries on from where this one stopped; use 0 for no limit
+      
+      - ``budget`` the max no. of backtweets requests to make per run, defaults
+        to 0 for no limit; the urls that are most likely to turn up new users
+        are checked first, and the rest wait for the next run
+      
+      - ``reconcile_delay`` the no. of hours between ``follow`` downloading the
+        full list of who the twitter account is following, defaults to a week;
+        in between, it goes by the users it's followed itself; use 0 to
+        download it every time
+      
+      - ``clock`` the function that says what time it is when deciding which
+        urls are due a check and whether the following list is due a
+        download, defaults to ``time.time``
+      
       If you only want to ``find`` twitter users, you can init with::
       
           >>> tt = TastyTweeter(
@@ -89,20 +169,35 @@ class TastyTweeter(object):
           [...]
       
       If you get a response from ``follow`` (that isn't ``[]``) then you'll have
-      a bunch of requests in a directory queue available at ``tt.queue``.  To
-      push a request up to twitter to follow that user::
+      a bunch of follow jobs in a directory queue available at ``tt.queue``.  To
+      push a request up to twitter to follow the next user in the queue (which
+      needs the twitter account info)::
       
           >>> tt.push()
           'push: OK'
       
       This returns ``'push: OK'`` if the request was made successfully, or 
       ``'push: Requeue'`` if there was a connection error, or ``'push: Error'`` if
-      the connection error has been repeated 3 times in a row or ``None`` if the
-      queue is empty.
+      the connection error has been repeated 3 times in a row (or the queued job
+      can't be read) or ``None`` if the queue is empty.  If twitter turns the
+      request down for good (e.g.: we already follow them), it isn't retried
+      and this returns ``'push: Rejected'``.
+      
+      To push everything in the queue from the one process, use ``drain``, which
+      paces the requests to stay within twitter's rate limit::
+      
+          >>> tt.drain()
+          {'push: OK': 12}
       
-      The ``TastyTweeter`` maintains a 'last tweet' ``status_id`` which records the
-      most recent tweet checked.  This is used to filter out the tweets already
-      picked up.  To reset the status_id::
+      Pass ``forever=True`` to keep checking the queue for new requests, rather
+      than returning once it's empty.
+      
+      The ``TastyTweeter`` maintains a 'last tweet' ``status_id`` for each tagged
+      url, which records the most recent tweet checked for that url.  This is
+      used to filter out the tweets already picked up.  Each url's status_id is
+      committed as soon as that url has been dealt with, so if a run falls over
+      halfway through, the next run picks up where it left off.  To reset the
+      status_ids::
       
           >>> tt.reset()
       
@@ -111,33 +206,88 @@ class TastyTweeter(object):
       ``reset_queue`` or ``reset_status_id``.
       
       From time to time you may want to remove the completed jobs from the queue,
-      using ``cleanup_queue``.
+      using ``cleanup_queue``, which spends at most ``max_seconds`` deleting them
+      and carries on from where it stopped the next time.  To see how many jobs
+      are in each state of the queue, use ``tt.queue.stats()``.
       
       
     """
-    status_ids = {}
+    state = None
     
     def _update_status_id(self):
-        if not os.path.exists(self.status_data_path):
-            self._init_status_id()
-        sock = open(self.status_data_path, 'r')
-        self.status_ids = pickle.load(sock)
-        self.status_ids['previous'] = self.status_ids['current']
-        sock.close()
+        if self.state is None:
+            from state import open_state_store
+            self.state = open_state_store(
+                self.status_data_path,
+                legacy_path = LEGACY_STATUS_DATA
+            )
+        
     
     def _commit_status_id(self):
-        sock = open(self.status_data_path, 'w')
-        pickle.dump(self.status_ids, sock)
-        sock.close()
+        started = time.time()
+        self.state.commit()
+        self.metrics.observe('commit_seconds', time.time() - started)
     
     def _init_status_id(self):
-        sock = open(self.status_data_path, 'w')
-        self.status_ids = {'current': 0}
-        self.status_ids = pickle.dump(self.status_ids, sock)
-        sock.close()
+        self._update_status_id()
+        self.state.reset_cursors()
+    
+    def _get_site_status_id(self, url):
+        return self.state.get_cursor(url, self.state.get('default', 0))
+    
+    def _update_site_status_id(self, url, latest):
+        if latest > self._get_site_status_id(url):
+            self.state.set_cursor(url, latest)
+        if latest > self.state.get('current', 0):
+            self.state.set('current', latest)
+    
+    def _get_site_cursor(self, url):
+        """
+          
+          Returns ``(since_id, page, latest)`` for the next backtweets search for
+          ``url``.  If the last search stopped at the ``max_pages`` limit, this
+          picks up from the page after the last one we got to, with ``latest``
+          the id of the newest tweet that search saw.  Otherwise we start from
+          the first page and ``latest`` is ``None``.
+          
+          
+        """
+        since_id = self._get_site_status_id(url)
+        backlog = self.state.get_site(url).get('backlog')
+        if backlog:
+            return since_id, backlog['page'], backlog['latest']
+        return since_id, 1, None
+    
+    def _track_site_status_id(self, url, tweets, cursor, progress):
+        since_id, page, latest = cursor
+        for tweet in tweets:
+            # the first tweet is the latest (Baby I know ... ;)
+            if latest is None:
+                latest = tweet['tweet_id']
+            yield tweet
+        if progress.get('unchecked'):
+            # the run's budget was spent before we got to it, so nothing's
+            # changed
+            return
+        if progress.get('next_page'):
+            # we haven't seen everything back to the status id yet, so we
+            # leave it where it is and carry on from the next page next time
+            self.state.update_site(url, backlog={
+                    'page': progress['next_page'],
+                    'latest': latest
+                }
+            )
+        else:
+            if page > 1:
+                self.state.update_site(url, backlog=None)
+            if latest is not None:
+                self._update_site_status_id(url, latest)
+            
+        
     
     
     def _make_request(self, url, method, headers):
+        import urllib, urllib2
         headers.setdefault('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8')
         headers.setdefault('User-Agent', 'Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10.4; en-GB; rv:1.9.0.7) Gecko/2009021906 Firefox/3.0.7')
         if method == 'POST':
@@ -147,58 +297,589 @@ class TastyTweeter(object):
             request = urllib2.Request(url, headers=headers)
         return request
     
+    def _get_endpoint(self, url):
+        endpoints = (
+            ('backtweets', BACKTWEETS_URL),
+            ('delicious', DELICIOUS_URL),
+            ('following', TWITTER_FOLLOWING_URL),
+            ('follow', TWITTER_FOLLOW_URL)
+        )
+        for name, endpoint_url in endpoints:
+            if url.startswith(endpoint_url.split('%s')[0]):
+                return name
+        return 'other'
+    
     def _send_request(self, request):
-        return urllib2.urlopen(request)
+        import urllib2
+        endpoint = self._get_endpoint(request.get_full_url())
+        started = time.time()
+        status = 'error'
+        try:
+            response = self.transport.send(request)
+            status = getattr(response, 'code', 200)
+            return response
+        except urllib2.HTTPError, e:
+            status = e.code
+            raise
+        finally:
+            self.metrics.incr('requests', endpoint=endpoint, status=status)
+            self.metrics.observe('request_seconds', time.time() - started, endpoint=endpoint)
+        
+    
     
     def _request(self, url, method='GET', headers={}):
         request = self._make_request(url, method, headers)
         return self._send_request(request)
     
+    def _get_auth_header(self):
+        raw = "%s:%s" % (self.twitter_user, self.twitter_pwd)
+        auth = base64.encodestring(raw).strip()
+        return {'AUTHORIZATION': 'Basic %s' % auth}
+    
     
     def get_existing_users(self, user, password):
+        """
+          
+          Returns the ids of the users ``user`` is following, as an ``IntSet``.
+          The ids are read into an ``array`` as the response comes in, rather
+          than parsed into a list, and sorted once to build the set.
+          
+          
+        """
         url = TWITTER_FOLLOWING_URL % user
         sock = self._request(url, headers=self.auth_header)
-        return json.load(sock)
+        return IntSet(read_int_array(sock))
     
-    def get_sites(self, user, tags):
+    def sync_following(self):
+        """
+          
+          Brings the local copy of who ``self.twitter_user`` is following up to
+          date, adding the users pushes have followed since the last sync.  If
+          it's been ``self.reconcile_delay`` hours since the last time, it's
+          replaced with the full list from twitter first (see
+          ``get_existing_users``), which picks up the users followed and
+          unfollowed from elsewhere.
+          
+          The follow requests pushes have finished with (followed or given
+          up on) are forgotten as well, so a user whose request failed can
+          be queued again.
+          
+          
+        """
+        existing_users = None
+        if self._is_reconcile_due():
+            existing_users = self._download_following()
+        self._merge_following(existing_users)
+    
+    def _is_reconcile_due(self):
+        reconciled = self.state.get('reconciled')
+        return reconciled is None or self.clock() - reconciled >= self.reconcile_delay * 60 * 60
+    
+    def _download_following(self):
+        # returns ``(reconciled, existing_users)``, for ``_merge_following``
+        reconciled = self.clock()
+        started = time.time()
+        existing_users = self.get_existing_users(self.twitter_user, self.twitter_pwd)
+        self.metrics.observe('phase_seconds', time.time() - started, phase='get_existing_users')
+        return reconciled, existing_users
+    
+    def _merge_following(self, downloaded=None):
+        if downloaded is not None:
+            reconciled, existing_users = downloaded
+            self.state.set_following(existing_users)
+            self.state.set('reconciled', reconciled)
+        # hold the lock until the log's been committed, so no push adds to
+        # it in the meantime
+        log_path = os.path.join(self.queue_dir, FOLLOWED_LOG)
+        lock = QueueLock(os.path.join(self.queue_dir, LOCK_FILE))
+        lock.acquire()
+        try:
+            if os.path.exists(log_path):
+                sock = open(log_path, 'r')
+                for line in sock:
+                    parts = line.split()
+                    if not parts:
+                        continue
+                    user_id = int(parts[0])
+                    if parts[1:] != ['dropped']:
+                        self.state.add_following(user_id)
+                    # either way, their follow request isn't waiting any
+                    # more, so they can be queued again if they're not
+                    # being followed
+                    self.state.remove_user(user_id)
+                sock.close()
+            self._commit_status_id()
+            if os.path.exists(log_path):
+                os.remove(log_path)
+        finally:
+            lock.release()
+    
+    def get_bookmarks(self, user, tags):
+        """
+          
+          Returns the bookmarks in the delicious feed of ``user``'s urls tagged
+          with ``tags``, newest first, as dicts with the url as ``'u'`` and the
+          time it was bookmarked as ``'dt'``.
+          
+          
+        """
+        import urllib2
+        started = time.time()
         url = DELICIOUS_URL % (
             user,
             tags
         )
-        sock = self._request(url)
-        results = json.load(sock)
-        for item in results:
-            yield item['u']
+        if self.cache is None:
+            sock = self._request(url)
+            bookmarks = [{'u': item['u'], 'dt': item.get('dt')} for item in json.load(sock)]
+            self.metrics.observe('phase_seconds', time.time() - started, phase='get_sites')
+            return bookmarks
+        # only download the feed if it's changed since we cached it
+        cached = self.cache.get(url)
+        try:
+            sock = self._request(url, headers=self.cache.conditional_headers(cached))
+        except urllib2.HTTPError, e:
+            if e.code != 304 or cached is None:
+                raise
+            bookmarks = cached['data']
+            etag = cached['etag']
+            last_modified = cached['last_modified']
+        else:
+            bookmarks = [{'u': item['u'], 'dt': item.get('dt')} for item in json.load(sock)]
+            etag = sock.info().getheader('etag')
+            last_modified = sock.info().getheader('last-modified')
+        self.cache.set(url, bookmarks, etag=etag, last_modified=last_modified)
+        self.metrics.observe('phase_seconds', time.time() - started, phase='get_sites')
+        # feeds cached by older versions only kept the urls
+        return [isinstance(item, dict) and item or {'u': item} for item in bookmarks]
+    
+    def get_sites(self, user, tags):
+        for bookmark in self.get_bookmarks(user, tags):
+            yield bookmark['u']
         
     
-    def get_users_for_site(self, url):
-        params = {
-            'q': url,
-            'since_id': self.status_ids['previous'],
-            'key': self.backtweets_key,
-            'itemsperpage': 100
-        }
-        url = '%s?%s' % (
-            BACKTWEETS_URL,
-            urllib.urlencode(params)
+    def _parse_bookmark_time(self, value):
+        # delicious gives times like 2009-07-21T11:56:27Z
+        import calendar
+        try:
+            return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+        except (TypeError, ValueError):
+            return None
+        
+    
+    def _get_feed(self):
+        return '%s/%s' % (self.delicious_user, self.tags)
+    
+    def _get_site_hit_rate(self, site):
+        # indexes from before we kept the hit rate only have the totals
+        if 'hit_rate' in site:
+            return site['hit_rate']
+        return float(site.get('hits', 0)) / site['queries']
+    
+    def _get_site_priority(self, site):
+        # urls that have never been checked come first, newest first, then
+        # the ones with the highest hit rate, longest unchecked first
+        if not site.get('queries'):
+            return 0, -(site.get('added') or 0)
+        return 1, -self._get_site_hit_rate(site), site.get('last_checked') or 0
+    
+    def _is_site_due(self, site, now):
+        # a url with pages of results left to read is always due
+        if site.get('backlog'):
+            return True
+        next_check = site.get('next_check')
+        return next_check is None or next_check <= now
+    
+    def _record_site_check(self, url, hits):
+        """
+          
+          Records that checking ``url`` found ``hits`` new users.  Its hit rate
+          is a moving average of the hits per check, weighted towards the
+          latest checks.  A url that found no one isn't due again for
+          ``COLD_DELAY`` hours, doubling each time in a row it finds no one,
+          up to ``MAX_COLD_DELAY``.
+          
+          
+        """
+        now = self.clock()
+        site = self.state.get_site(url)
+        if site.get('queries'):
+            hit_rate = HIT_RATE_WEIGHT * hits + (1 - HIT_RATE_WEIGHT) * self._get_site_hit_rate(site)
+        else:
+            hit_rate = float(hits)
+        misses = not hits and site.get('misses', 0) + 1 or 0
+        next_check = None
+        if misses:
+            delay = min(MAX_COLD_DELAY, COLD_DELAY * 2 ** (misses - 1))
+            next_check = now + delay * 60 * 60
+        self.state.update_site(url,
+            last_checked = now,
+            queries = site.get('queries', 0) + 1,
+            hits = site.get('hits', 0) + hits,
+            misses = misses,
+            next_check = next_check,
+            hit_rate = hit_rate
         )
-        sock = self._request(url)
-        data = json.load(sock)
-        # the first tweet is the latest (Baby I know ... ;)
-        if len(data['tweets']):
-            latest = data['tweets'][0]
-            if latest['tweet_id'] > self.status_ids['current']:
-                self.status_ids['current'] = latest['tweet_id']
-        for item in data['tweets']:
+    
+    def get_indexed_sites(self, due=False):
+        """
+          
+          Returns the (normalized) urls in the index of tagged urls, in the
+          order they should be checked: urls that have never been checked
+          first, most recently bookmarked first, then by hit rate (the no.
+          of new users found per check, see ``_record_site_check``), then the
+          longest since they were last checked.
+          
+          If ``due`` is true, the urls that have been backed off from, having
+          found no one the last time they were checked, are left out until
+          they're due to be checked again.
+          
+          
+        """
+        now = self.clock()
+        feed = self._get_feed()
+        sites = []
+        for url, site in self.state.get_sites().iteritems():
+            if not feed in site.get('feeds', ()):
+                continue
+            if due and not self._is_site_due(site, now):
+                continue
+            sites.append((self._get_site_priority(site), url))
+        sites.sort()
+        return [url for priority, url in sites]
+    
+    def sync_sites(self, due=False):
+        """
+          
+          Adds the bookmarks in the delicious feed that aren't in the index
+          of tagged urls yet and returns the indexed urls (only those due a
+          check, if ``due`` is true) by priority (see ``get_indexed_sites``).
+          
+          The delicious feed only lists the latest 100 bookmarks, but the index
+          keeps every url it's ever listed, with when it was bookmarked, when
+          it was last checked and how many new users checking it has found,
+          so older urls carry on being checked once they've dropped out of the
+          feed.  A url that's missing from the feed even though it's newer than
+          the oldest bookmark in it has been untagged or deleted, so it's taken
+          out of the feed's urls.
+          
+          
+        """
+        self._index_bookmarks(self.get_bookmarks(self.delicious_user, self.tags))
+        return self.get_indexed_sites(due=due)
+    
+    def _index_bookmarks(self, bookmarks):
+        from lookups import normalize_url
+        feed = self._get_feed()
+        # n.b.: the feed is ordered by when each url was first bookmarked, so
+        # an old bookmark that's just been tagged turns up below the newer
+        # ones, and we go through the whole feed rather than stopping at the
+        # ones we've seen before
+        listed = set()
+        oldest = None
+        for bookmark in bookmarks:
+            added = self._parse_bookmark_time(bookmark.get('dt'))
+            if added is not None and (oldest is None or added < oldest):
+                oldest = added
+            raw_url = bookmark['u']
+            url = normalize_url(raw_url)
+            listed.add(url)
+            site = self.state.get_site(url)
+            feeds = site.get('feeds', [])
+            if feed in feeds:
+                continue
+            # carry over the status id we kept under the raw url
+            if url != raw_url and self.state.get_cursor(url) is None:
+                since_id = self.state.get_cursor(raw_url)
+                if since_id is not None:
+                    self.state.set_cursor(url, since_id)
+                
+            self.state.update_site(url,
+                feeds = feeds + [feed],
+                added = site.get('added') or added or self.clock()
+            )
+        
+        if oldest is not None:
+            # a url that was bookmarked since the oldest one in the feed but
+            # isn't in it any more has been untagged (or deleted), so it's
+            # no longer checked for this feed
+            for url, site in self.state.get_sites().iteritems():
+                feeds = site.get('feeds', [])
+                if feed in feeds and not url in listed and (site.get('added') or 0) >= oldest:
+                    self.state.update_site(url, feeds=[f for f in feeds if f != feed])
+            
+        self._commit_status_id()
+    
+    
+    def _get_tweets_for_site(self, url, since_id, page=1, progress=None, pages=None):
+        """
+          
+          Yields the tweets of ``url`` newer than ``since_id``, newest first,
+          walking through the pages of backtweets results as it goes.  Stops
+          once a page comes back short, or a tweet isn't newer than ``since_id``
+          or, having read ``self.max_pages`` pages or the ``pages`` its share of
+          the run's budget allows (see ``_plan_pages``), in which case the page
+          to carry on from is stored as ``progress['next_page']`` (and
+          ``progress['unchecked']`` is set if it wasn't allowed any).  The same
+          goes for a page that a ``--replay`` doesn't have the response to.
+          
+          
+        """
+        import urllib, urllib2
+        read = 0
+        while True:
+            if pages is not None and read >= pages:
+                if progress is not None:
+                    progress['next_page'] = page
+                    if not read:
+                        # we didn't get to search for it at all
+                        progress['unchecked'] = True
+                return
+            params = {
+                'q': url,
+                'since_id': since_id,
+                'key': self.backtweets_key,
+                'itemsperpage': ITEMS_PER_PAGE,
+                'page': page
+            }
+            try:
+                sock = self._request('%s?%s' % (
+                        BACKTWEETS_URL,
+                        urllib.urlencode(params)
+                    )
+                )
+            except urllib2.URLError, e:
+                from snapshot import SnapshotMiss
+                if not isinstance(e, SnapshotMiss):
+                    raise
+                # a replay asking for more than its capture did (e.g.: with a
+                # bigger budget) leaves the url where it got to, as running
+                # out of budget does
+                if progress is not None:
+                    progress['next_page'] = page
+                    if not read:
+                        progress['unchecked'] = True
+                return
+            # the tweets are parsed as they're read from the response
+            tweets = iter_array(sock, 'tweets')
+            count = 0
+            for tweet in tweets:
+                if tweet['tweet_id'] <= since_id:
+                    tweets.close()
+                    return
+                count += 1
+                yield tweet
+            if count < ITEMS_PER_PAGE:
+                return
+            page += 1
+            read += 1
+            if self.max_pages and read >= self.max_pages:
+                if progress is not None:
+                    progress['next_page'] = page
+                return
+            
+        
+    
+    def _fetch_tweets_for_site(self, url, since_id, page, progress, pages):
+        # as ``_lookup_tweets_for_site``, timing how long the url's pages
+        # take to fetch and read, but not what's done with each tweet
+        elapsed = 0.0
+        started = time.time()
+        tweets = self._lookup_tweets_for_site(url, since_id, page, progress, pages)
+        while True:
+            try:
+                tweet = tweets.next()
+            except StopIteration:
+                break
+            elapsed += time.time() - started
+            yield tweet
+            started = time.time()
+        elapsed += time.time() - started
+        if not progress.get('unchecked'):
+            self.metrics.observe('phase_seconds', elapsed, phase='get_users_for_site')
+        
+    
+    def _lookup_tweets_for_site(self, url, since_id, page, progress, pages):
+        # as ``_get_tweets_for_site`` but going through the lookup cache
+        if self.lookup_cache is None:
+            return self._get_tweets_for_site(url, since_id, page, progress, pages)
+        def fetch():
+            fetched_progress = {}
+            tweets = list(self._get_tweets_for_site(url, since_id, page, fetched_progress, pages))
+            if fetched_progress.get('unchecked'):
+                # not worth keeping, so whoever asks next searches for it
+                return None
+            return tweets, fetched_progress
+        key = (url, since_id, page, self.max_pages, pages)
+        result = self.lookup_cache.get(key, fetch)
+        if result is None:
+            progress['unchecked'] = True
+            return iter([])
+        tweets, fetched_progress = result
+        progress.update(fetched_progress)
+        return iter(tweets)
+    
+    def _get_tweets_for_sites(self, urls):
+        """
+          
+          Yields ``(url, tweets)`` for each of the ``urls``, in the order they
+          were given, with up to ``self.concurrency`` urls being fetched at
+          once.  ``tweets`` is an iterator, which should be used up before
+          moving on to the next url.
+          
+          If the urls are fetched one at a time, the tweets are yielded as
+          they're read from the responses.  Otherwise each url's pages are read
+          in full by a worker thread.  Either way, each url's status id is
+          updated from the calling thread once its tweets have been iterated
+          over, so it doesn't matter what order the responses come back in.
+          If a request fails, the error is raised when its url comes up, just
+          as it would be if the urls were fetched one at a time.
+          
+          The run's budget of backtweets requests is shared out between the
+          urls, in order, before any are fetched (see ``_plan_pages``), so the
+          same urls are checked however many are fetched at once.  The urls
+          it doesn't stretch to are left out.
+          
+          
+        """
+        urls = [
+            (url, pages) for url, pages in self._plan_pages(list(urls))
+            if pages != 0
+        ]
+        if self.concurrency < 2:
+            for url, pages in urls:
+                cursor = self._get_site_cursor(url)
+                progress = {}
+                since_id, page, latest = cursor
+                tweets = self._fetch_tweets_for_site(url, since_id, page, progress, pages)
+                yield url, self._track_site_status_id(url, tweets, cursor, progress)
+            return
+        import threading
+        from Queue import Queue, Empty
+        jobs = Queue()
+        results = Queue()
+        # the state store is only used from this thread, so we look up
+        # the status ids here rather than in the workers
+        for i, (url, pages) in enumerate(urls):
+            jobs.put((i, url, self._get_site_cursor(url), pages))
+        def worker():
+            while True:
+                try:
+                    i, url, cursor, pages = jobs.get_nowait()
+                except Empty:
+                    return
+                progress = {}
+                since_id, page, latest = cursor
+                try:
+                    tweets = list(
+                        self._fetch_tweets_for_site(url, since_id, page, progress, pages)
+                    )
+                    results.put((i, cursor, tweets, progress, None))
+                except Exception, e:
+                    results.put((i, cursor, None, progress, e))
+                
+            
+        for i in range(min(self.concurrency, len(urls))):
+            thread = threading.Thread(target=worker)
+            thread.setDaemon(True)
+            thread.start()
+        # hold on to early responses until it's their turn
+        pending = {}
+        for i, (url, pages) in enumerate(urls):
+            while not i in pending:
+                result = results.get()
+                pending[result[0]] = result[1:]
+            cursor, tweets, progress, error = pending.pop(i)
+            if error is not None:
+                raise error
+            if progress.get('unchecked'):
+                # we didn't get to search for it
+                continue
+            yield url, self._track_site_status_id(url, tweets, cursor, progress)
+        
+    
+    def _plan_pages(self, urls):
+        """
+          
+          Shares the run's budget of backtweets requests out between ``urls``,
+          in the order they're given, returning a list of ``(url, pages)``,
+          with the no. of pages of results each can read (``None`` for no
+          limit).  Every url's first page comes before any url's later pages,
+          which get the rest of the budget, each url in turn, up to
+          ``self.max_pages``.
+          
+          It's done up front, from the calling thread, so the budget goes to
+          the urls most likely to turn up new users, rather than to whichever
+          request gets in first.
+          
+          
+        """
+        firsts = [self.call_budget.reserve(1) for url in urls]
+        planned = []
+        for url, first in zip(urls, firsts):
+            if not first:
+                planned.append((url, 0))
+                continue
+            limit = None
+            if self.max_pages:
+                limit = self.max_pages - 1
+            more = self.call_budget.reserve(limit)
+            planned.append((url, more is not None and 1 + more or None))
+        return planned
+    
+    def get_users_for_site(self, url):
+        from lookups import normalize_url
+        url = normalize_url(url)
+        cursor = self._get_site_cursor(url)
+        progress = {}
+        since_id, page, latest = cursor
+        [(url, pages)] = self._plan_pages([url])
+        tweets = self._fetch_tweets_for_site(url, since_id, page, progress, pages)
+        for item in self._track_site_status_id(url, tweets, cursor, progress):
             yield item
         
     
     
-    def cleanup_queue(self):
-        self.queue.clear()
+    def _mark_queue_empty(self):
+        sock = open(os.path.join(self.queue_dir, EMPTY_MARK), 'w')
+        sock.close()
+    
+    def _unmark_queue_empty(self):
+        try:
+            os.remove(os.path.join(self.queue_dir, EMPTY_MARK))
+        except OSError:
+            pass
+        
+    
+    def _log_pushed(self, job, followed=True):
+        # pushes don't open the status data, which a follow may have locked,
+        # so they log who they've followed (or given up on) for the next
+        # follow to pick up
+        if job.get('user_id') is None:
+            # queued by an older version
+            return
+        line = followed and '%d\n' or '%d dropped\n'
+        lock = QueueLock(os.path.join(self.queue_dir, LOCK_FILE))
+        lock.acquire()
+        try:
+            sock = open(os.path.join(self.queue_dir, FOLLOWED_LOG), 'a')
+            sock.write(line % job['user_id'])
+            sock.close()
+        finally:
+            lock.release()
+    
+    def cleanup_queue(self, max_seconds=CLEANUP_TIME):
+        return self.queue.clear(max_seconds=max_seconds)
     
     def reset_queue(self):
+        # the log of who pushes have followed goes with the queue, so pick
+        # it up first, or we'd follow them all over again
+        self._update_status_id()
+        self._merge_following()
         shutil.rmtree(self.queue_dir)
+        # the users whose requests were in it aren't waiting any more
+        self.state.clear_users()
+        self._commit_status_id()
     
     def reset_status_id(self):
         self._init_status_id()
@@ -206,7 +887,7 @@ class TastyTweeter(object):
     def reset(self):
         """
           
-          Reset the latest tweet status id - thus scraping all the
+          Reset the latest tweet status ids - thus scraping all the
           users from way back - and reset the follow queue.
           
           
@@ -224,31 +905,37 @@ class TastyTweeter(object):
           
         """
         
-        # get the tagged urls
-        self.urls = self.get_sites(self.delicious_user, self.tags)
+        started = time.time()
         
-        # update the last-checked-tweet status id
+        # load the last-checked-tweet status ids
         self._update_status_id()
         
-        # we build a list of dicovered users
-        discovered_users = []
+        # sync the tagged urls and get the ones due a check, by priority
+        self.urls = self.sync_sites(due=True)
+        self.call_budget = CallBudget(self.budget)
         
-        # for each tagged site
-        for url in self.urls:
-            # find the twitter users who's posted the url
-            site_users = self.get_users_for_site(url)
+        # we build a set of dicovered users
+        discovered_users = set()
+        
+        # for each tagged site, find the twitter users who's posted the url
+        for url, site_users in self._get_tweets_for_sites(self.urls):
+            # n.b.: a url's hits include the users other urls found as well,
+            # so they don't depend on which order the urls come in
+            site_discovered = set()
             for user in site_users:
-                username = user['tweet_from_user'].lower()
-                if not username in discovered_users:
-                    discovered_users.append(username)
+                site_discovered.add(user['tweet_from_user'].lower())
                 
+            discovered_users.update(site_discovered)
+            # store the updated status id and hits for this url
+            self._record_site_check(url, len(site_discovered))
+            self._commit_status_id()
+            self.metrics.incr('sites', phase='find')
             
-        # store the updated status id
-        self._commit_status_id()
+        self.metrics.observe('phase_seconds', time.time() - started, phase='find')
+        self.metrics.incr('users', len(discovered_users), phase='find')
         
-        # return the list
-        discovered_users.sort()
-        return discovered_users
+        # return the sorted list
+        return sorted(discovered_users)
     
     def follow(self):
         """
@@ -262,52 +949,55 @@ class TastyTweeter(object):
           
         """
         
-        # get the tagged urls
-        self.urls = self.get_sites(self.delicious_user, self.tags)
+        started = time.time()
         
-        # update the last-checked-tweet status id
+        # load the last-checked-tweet status ids
         self._update_status_id()
         
+        # sync the tagged urls and get the ones due a check, by priority
+        self.urls = self.sync_sites(due=True)
+        self.call_budget = CallBudget(self.budget)
+        
         # accessing twitter needs https auth, which we do with a simple header
-        raw = "%s:%s" % (self.twitter_user, self.twitter_pwd)
-        auth = base64.encodestring(raw).strip()
-        self.auth_header = {'AUTHORIZATION': 'Basic %s' % auth}
+        self.auth_header = self._get_auth_header()
         
-        # get existing users
-        self.existing_users = self.get_existing_users(self.twitter_user, self.twitter_pwd)
+        # catch up with who we're following
+        self.sync_following()
         
         # we build a list of new users
         following = []
+        queued = set()
         
-        # for each tagged site
-        for url in self.urls:
-            # find the twitter users who's posted the url
-            site_users = self.get_users_for_site(url)
+        # for each tagged site, find the twitter users who's posted the url
+        for url, site_users in self._get_tweets_for_sites(self.urls):
+            hits = set()
             for user in site_users:
                 userid = user['tweet_from_user_id']
-                if not userid in self.existing_users:
+                if userid in queued:
+                    # an earlier url found them this run, which counts as a
+                    # hit for this one too
+                    hits.add(userid)
+                # n.b.: we know about the users whose requests are still
+                # waiting in the queue
+                elif not (self.state.is_following(userid) or self.state.has_user(userid)):
                     username = user['tweet_from_user'].lower()
-                    self.existing_users.append(userid)
-                    request = self._make_request(
-                        TWITTER_FOLLOW_URL % username, 
-                        'POST',
-                        self.auth_header
-                    )
-                    queue_item = self.queue.newQueueItem(username)
-                    sock = open(queue_item.dataFileName(), 'w')
-                    pickle.dump({
-                            'errors': 0, 
-                            'request': request
-                        }, 
-                        sock
-                    )
-                    sock.close()
-                    self.queue.itemReady(queue_item)
+                    self.state.add_user(userid, username)
+                    job = new_job(userid, username)
+                    self.queue.put(username, encode_job(job))
+                    # the queue isn't empty any more, even if a push has
+                    # drained and marked it since our last put
+                    self._unmark_queue_empty()
                     following.append(username)
+                    queued.add(userid)
+                    hits.add(userid)
                 
+            # store the updated status id and hits for this url
+            self._record_site_check(url, len(hits))
+            self._commit_status_id()
+            self.metrics.incr('sites', phase='follow')
             
-        # store the updated status id
-        self._commit_status_id()
+        self.metrics.observe('phase_seconds', time.time() - started, phase='follow')
+        self.metrics.incr('users', len(following), phase='follow')
         
         # return the list
         following.sort()
@@ -316,31 +1006,159 @@ class TastyTweeter(object):
         
     
     
+    def get_backoff(self, url):
+        """
+          
+          Returns the ``Backoff`` pacing our requests to the host of ``url``.
+          
+          
+        """
+        import urllib
+        host = urllib.splithost(urllib.splittype(url)[1])[0]
+        if host not in self.backoffs:
+            self.backoffs[host] = Backoff()
+        return self.backoffs[host]
+    
+    def _requeue(self, queue_item, job):
+        if job['errors'] < MAX_ERRORS:
+            job['errors'] += 1
+            self.queue.setData(queue_item, encode_job(job))
+            self.queue.itemRequeue(queue_item)
+            # another push may have found the queue empty in the meantime
+            self._unmark_queue_empty()
+            return 'push: Requeue'
+        else:
+            self.queue.itemError(queue_item)
+            self._log_pushed(job, followed=False)
+            return 'push: Error'
+        
+    
+    def _get_rejection(self, error):
+        """
+          
+          Returns why twitter turned down a follow request for good, from the
+          ``urllib2.HTTPError`` it failed with: ``'following'`` if we already
+          follow the user, ``'rejected'`` if we can't follow them (e.g.: they
+          don't exist or they've blocked us), or ``None`` if it's worth trying
+          again later.  A 403 is only taken as final if it says why, as twitter
+          also answers 403 when we're over the follow limit.
+          
+          
+        """
+        if error.code in PERMANENT_ERRORS:
+            return 'rejected'
+        if error.code != 403:
+            return None
+        try:
+            body = error.read().lower()
+        except (AttributeError, IOError):
+            return None
+        for phrase in ALREADY_FOLLOWING_ERRORS:
+            if phrase in body:
+                return 'following'
+        for phrase in BLOCKED_ERRORS:
+            if phrase in body:
+                return 'rejected'
+        return None
+    
+    def _push(self, queue_item):
+        import urllib2
+        data = self.queue.getData(queue_item)
+        try:
+            job = decode_job(data)
+        except Exception:
+            # it'll never be any more readable, so put it aside
+            self.queue.itemError(queue_item)
+            return 'push: Error'
+        # jobs queued by older versions come with their request
+        request = job.get('request')
+        if request is None:
+            request = self._make_request(
+                TWITTER_FOLLOW_URL % job['username'],
+                'POST',
+                self._get_auth_header()
+            )
+        backoff = self.get_backoff(request.get_full_url())
+        try:
+            response = self._send_request(request)
+            headers = response.info()
+            # read the body to the end, so the connection goes back in the pool
+            response.read()
+            response.close()
+        except urllib2.HTTPError, e:
+            headers = e.hdrs or {}
+            rejection = self._get_rejection(e)
+            if rejection is not None:
+                # there's no use retrying, and if we already follow them,
+                # the next follow should know it
+                backoff.success(headers)
+                self.queue.itemError(queue_item)
+                self._log_pushed(job, followed=rejection == 'following')
+                return 'push: Rejected'
+            backoff.failure(headers)
+            return self._requeue(queue_item, job)
+        except IOError, e:
+            backoff.failure()
+            return self._requeue(queue_item, job)
+        backoff.success(headers)
+        self.queue.itemDone(queue_item)
+        self._log_pushed(job)
+        return 'push: OK'
+    
     def push(self):
         queue_item = self.queue.getNext()
+        if not queue_item and not self.queue.stats().get('active'):
+            # n.b.: not while other pushes have items claimed, in case their
+            # leases run out and the items need handing out again
+            self._mark_queue_empty()
+            # check again, in case something was queued as we marked it
+            queue_item = self.queue.getNext()
+            if queue_item:
+                self._unmark_queue_empty()
         if queue_item:
-            sock = open(queue_item.dataFileName(), 'r')
-            data = pickle.load(sock)
-            sock.close()
-            try:
-                self._send_request(data['request'])
-                self.queue.itemDone(queue_item)
-                return 'push: OK'
-            except IOError, e:
-                if data['errors'] < 3:
-                    data['errors'] += 1
-                    sock = open(queue_item.dataFileName(), 'w')
-                    pickle.dump(data, sock)
-                    sock.close()
-                    self.queue.itemRequeue(queue_item)
-                    return 'push: Requeue'
-                else:
-                    self.queue.itemError(queue_item)
-                    return 'push: Error'
+            response = self._push(queue_item)
+            self.metrics.incr('pushes', response=response)
+            return response
         return None
     
+    def drain(self, rate_limit=RATE_LIMIT, forever=False, idle_delay=PUSH_DELAY):
+        """
+          
+          Pushes queued requests until the queue is empty, at most ``rate_limit``
+          an hour.  Returns a dict of how many times ``push`` got each response.
+          
+          Once twitter's responses say how many requests we have left, they're
+          spread over the rest of its window instead, and after a failure, it
+          waits as long as twitter asks, or backs off exponentially.
+          
+          If ``forever`` is true, it doesn't return when the queue is empty but
+          sleeps for ``idle_delay`` minutes and then checks again.
+          
+          
+        """
+        bucket = TokenBucket(rate_limit, per=3600)
+        backoff = self.get_backoff(TWITTER_FOLLOW_URL)
+        responses = {}
+        while True:
+            time.sleep(backoff.delay())
+            # unless twitter's told us its limit, keep to ours
+            if not backoff.paced:
+                bucket.consume()
+            response = self.push()
+            if response is None:
+                # give back the token we didn't use
+                if not backoff.paced:
+                    bucket.tokens += 1
+                if not forever:
+                    break
+                time.sleep(idle_delay * 60)
+            else:
+                responses[response] = responses.get(response, 0) + 1
+            
+        return responses
     
-    def __init__(self, twitter_user='', twitter_pwd='', backtweets_key='', delicious_user=None, tags=['follow'], status_data=STATUS_DATA, queue_dir=QUEUE_DIR):
+    
+    def __init__(self, twitter_user='', twitter_pwd='', backtweets_key='', delicious_user=None, tags=['follow'], status_data=STATUS_DATA, queue_dir=QUEUE_DIR, concurrency=CONCURRENCY, state_store=None, transport=None, cache_dir=CACHE_DIR, max_pages=MAX_PAGES, segment_queue=False, lookup_cache=None, metrics=None, budget=BUDGET, reconcile_delay=RECONCILE_DELAY, clock=time.time):
         # store the init params
         self.twitter_user = twitter_user
         self.twitter_pwd = twitter_pwd
@@ -349,14 +1167,46 @@ class TastyTweeter(object):
         self.tags = '+'.join(tags)
         self.status_data_path = status_data
         self.queue_dir = queue_dir
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.budget = budget
+        self.call_budget = CallBudget(budget)
+        self.reconcile_delay = reconcile_delay
+        self.clock = clock
+        self.lookup_cache = lookup_cache
+        self.backoffs = {}
+        self.state = state_store
+        if transport is None:
+            from transport import HTTPTransport
+            transport = HTTPTransport()
+        self.transport = transport
+        self.cache = cache_dir and ResponseCache(cache_dir) or None
+        self.metrics = metrics is None and NullMetrics() or metrics
         
         # init the queue
         if not os.path.exists(self.queue_dir):
             os.mkdir(self.queue_dir)
-        self.queue = ClearableDirectoryQueue(self.queue_dir, GenericQueueItem)
+        if segment_queue:
+            self.queue = SegmentQueue(self.queue_dir)
+        else:
+            self.queue = ClearableDirectoryQueue(self.queue_dir, GenericQueueItem)
+        if metrics is not None:
+            self.queue = InstrumentedQueue(self.queue, metrics)
     
 
 
+def is_queue_marked_empty(queue_dir):
+    """
+      
+      Returns ``True`` if the last ``push`` from the queue at ``queue_dir``
+      found it empty and nothing's been queued since, which only takes a
+      ``stat``, without loading the queue.
+      
+      
+    """
+    return os.path.exists(os.path.join(queue_dir, EMPTY_MARK))
+
+
 def parse_options():
     from optparse import OptionParser
     parser = OptionParser()
@@ -379,12 +1229,32 @@ def parse_options():
     )
     parser.add_option(
         "-s", "--status-data-path", type="string", dest="status_data", default=STATUS_DATA,
-        help="full path to the file where you want to store the status data, defaults to ~/.tastytweets-statusdata.pkl"
+        help="full path to the file where you want to store the status data, defaults to ~/.tastytweets-status.db"
     )
     parser.add_option(
         "-q", "--queue-directory-path", type="string", dest="queue_dir", default=QUEUE_DIR,
         help="full path to the queue where you want to store the follow request job items, defaults to ~/.tastytweets-queue"
     )
+    parser.add_option(
+        "--cache-directory-path", type="string", dest="cache_dir", default=CACHE_DIR,
+        help="full path to the directory where you want to cache the delicious feed, defaults to ~/.tastytweets-cache"
+    )
+    parser.add_option(
+        "--no-cache", action="store_const", const=None, dest="cache_dir",
+        help="download the delicious feed in full every time"
+    )
+    parser.add_option(
+        "--segment-queue", action="store_true", dest="segment_queue", default=False,
+        help="queue the follow requests many to a file, rather than a directory each"
+    )
+    parser.add_option(
+        "--cleanup-time", type="float", dest="cleanup_time", default=CLEANUP_TIME,
+        help="max no. of seconds to spend deleting done and failed jobs from the queue each time we follow, defaults to 10"
+    )
+    parser.add_option(
+        "--config", type="string", dest="config", default=None,
+        help="full path to the config file listing the profiles for tastytweets-multi to run, defaults to ~/.tastytweets.cfg"
+    )
     parser.add_option(
         "-o", "--cron-output", type="string", dest="cron_log_file",  default=CRON_OUTPUT_LOG_FILE,
         help="full path to the log file you want any automated cron jobs to write to, defaults to ~/.tastytweets-output.log"
@@ -393,16 +1263,174 @@ def parse_options():
         "--follow-delay", type="int", dest="follow_delay", default=FOLLOW_DELAY,
         help="no. of hours to wait between calling follow when automated"
     )
+    parser.add_option(
+        "--reconcile-delay", type="int", dest="reconcile_delay", default=RECONCILE_DELAY,
+        help="no. of hours between downloading the full list of who you follow, defaults to a week, 0 for every follow"
+    )
     parser.add_option(
         "--push-delay", type="int", dest="push_delay", default=PUSH_DELAY,
         help="no. of minutes to wait between calling push when follow requests are queued up"
     )
+    parser.add_option(
+        "--drain", action="store_true", dest="drain", default=False,
+        help="don't add a cronjob to push follow requests, leave them for a tastytweets-drain process"
+    )
+    parser.add_option(
+        "--rate-limit", type="int", dest="rate_limit", default=RATE_LIMIT,
+        help="max no. of follow requests tastytweets-drain pushes an hour, defaults to 100"
+    )
+    parser.add_option(
+        "--forever", action="store_true", dest="forever", default=False,
+        help="keep tastytweets-drain running when the queue is empty, checking it every --push-delay minutes"
+    )
+    parser.add_option(
+        "--metrics-json", type="string", dest="metrics_json", default=None,
+        help="full path to a file to write a json summary of each run's requests and timings to"
+    )
+    parser.add_option(
+        "--metrics-textfile", type="string", dest="metrics_textfile", default=None,
+        help="full path to a file to write each run's requests and timings to, for prometheus' node exporter"
+    )
+    parser.add_option(
+        "--pid-file", type="string", dest="pid_file", default=None,
+        help="full path to the file tastytweets-daemon locks while it runs, defaults to ~/.tastytweets.pid"
+    )
+    parser.add_option(
+        "-c", "--concurrency", type="int", dest="concurrency", default=CONCURRENCY,
+        help="max no. of backtweets requests to make at the same time, defaults to 4"
+    )
+    parser.add_option(
+        "--async", action="store_true", dest="use_async", default=False,
+        help="download the delicious feed and who you're following at the same time as the backtweets requests, rather than first"
+    )
+    parser.add_option(
+        "--max-pages", type="int", dest="max_pages", default=MAX_PAGES,
+        help="max no. of pages of backtweets results to read for each url per run, defaults to 10, 0 for no limit"
+    )
+    parser.add_option(
+        "--budget", type="int", dest="budget", default=BUDGET,
+        help="max no. of backtweets requests to make per run, defaults to 0 for no limit"
+    )
+    parser.add_option(
+        "--capture", type="string", dest="capture", default=None,
+        help="full path to a snapshot file to save the delicious, backtweets and twitter responses to, leaving the status data and queue as they are"
+    )
+    parser.add_option(
+        "--replay", type="string", dest="replay", default=None,
+        help="full path to a snapshot file saved with --capture to answer the requests from, without the network, leaving the status data and queue as they are"
+    )
+    parser.add_option(
+        "--connect-timeout", type="float", dest="connect_timeout", default=None,
+        help="no. of seconds to wait for a connection to a server, defaults to 10"
+    )
+    parser.add_option(
+        "--read-timeout", type="float", dest="read_timeout", default=None,
+        help="no. of seconds to wait for a server to respond, defaults to 30"
+    )
     
     
     (options, args) = parser.parse_args()
+    options.metrics = None
+    options.plan = bool(options.capture or options.replay)
+    options.plan_state_store = None
+    options.plan_transport = None
+    options.plan_clock = None
+    if options.metrics_json or options.metrics_textfile:
+        from metrics import Metrics
+        options.metrics = Metrics()
     return options
 
 
+def get_transport(options):
+    if options.plan_transport is not None:
+        return options.plan_transport
+    from transport import HTTPTransport, CONNECT_TIMEOUT, READ_TIMEOUT
+    return HTTPTransport(
+        connect_timeout = options.connect_timeout or CONNECT_TIMEOUT,
+        read_timeout = options.read_timeout or READ_TIMEOUT
+    )
+
+
+def get_tweeter_class(options):
+    if options.use_async:
+        from asyncclient import AsyncTastyTweeter
+        return AsyncTastyTweeter
+    return TastyTweeter
+
+
+def start_plan(options):
+    """
+      
+      Sets up a ``--capture`` or ``--replay`` run, which works on a copy of
+      the status data in memory, queues into a throwaway directory and doesn't
+      use the cache, so it changes nothing on disk but the snapshot file.
+      
+      A capture makes its requests as normal and saves the responses, along
+      with the status data it started from, to the snapshot (see
+      ``tastytweets.snapshot``).  A replay starts from that status data and
+      answers its requests from the snapshot, so it can be run again and again
+      with different options, e.g.: narrower ``--delicious-tags``.  Any of
+      its backtweets searches that the capture didn't make (e.g.: with a
+      bigger ``--budget``) are left unchecked and listed when it's done.
+      
+      
+    """
+    if not options.plan:
+        return
+    import tempfile
+    from state import SqliteStateStore, is_sqlite_file
+    from snapshot import RecordingTransport, Snapshot, SnapshotTransport
+    options.cache_dir = None
+    options.queue_dir = tempfile.mkdtemp()
+    if options.replay:
+        snapshot = Snapshot(options.replay)
+        state = snapshot.state
+        options.plan_transport = SnapshotTransport(snapshot, feed_url=DELICIOUS_URL)
+        started = snapshot.started
+    else:
+        state = []
+        if os.path.exists(options.status_data) and is_sqlite_file(options.status_data):
+            store = SqliteStateStore(options.status_data)
+            state = store.dump()
+            store.close()
+        started = time.time()
+        options.plan_transport = RecordingTransport(
+            get_transport(options),
+            options.capture,
+            state = state,
+            started = started
+        )
+    # both go by the time the capture started, so a replay decides which
+    # urls are due (and whether the following list is) just as it did
+    options.plan_clock = lambda: started
+    options.plan_state_store = SqliteStateStore(':memory:')
+    options.plan_state_store.load(state)
+
+
+def finish_plan(options):
+    if not options.plan:
+        return
+    if options.capture:
+        options.plan_transport.save()
+    else:
+        # the backtweets searches the capture didn't make are skipped, rather
+        # than stopping the replay, so say which they were
+        for key in options.plan_transport.misses:
+            if not key.split(' ', 1)[1].startswith(BACKTWEETS_URL):
+                continue
+            print >> sys.stderr, 'tastytweets: skipped a search that isn\'t in the snapshot: %s' % key
+    options.plan_transport.close()
+    shutil.rmtree(options.queue_dir)
+
+
+def write_metrics(options):
+    # write out the metrics, if we were asked to keep them
+    if options.metrics_json:
+        options.metrics.write_json(options.metrics_json)
+    if options.metrics_textfile:
+        options.metrics.write_textfile(options.metrics_textfile)
+
+
 def find():
     options = parse_options()
     if not options.backtweets_key:
@@ -412,14 +1440,29 @@ def find():
             raise Exception('You must provide a delicious username, i.e.: -d mydelicioususername')
         else:
             options.delicious_user = options.twitter_user
-    tt = TastyTweeter(
+    start_plan(options)
+    tt = get_tweeter_class(options)(
         backtweets_key = options.backtweets_key,
         delicious_user = options.delicious_user,
         tags = options.tags.split(' '),
         status_data = options.status_data,
-        queue_dir = options.queue_dir
+        state_store = options.plan_state_store,
+        clock = options.plan_clock or time.time,
+        queue_dir = options.queue_dir,
+        concurrency = options.concurrency,
+        max_pages = options.max_pages,
+        budget = options.budget,
+        transport = get_transport(options),
+        cache_dir = options.cache_dir,
+        segment_queue = options.segment_queue,
+        metrics = options.metrics
     )
-    return tt.find()
+    try:
+        users = tt.find()
+    finally:
+        finish_plan(options)
+    write_metrics(options)
+    return users
 
 
 def follow():
@@ -430,31 +1473,64 @@ def follow():
         raise Exception('You must provide a twitter username, i.e.: -u mytwitterusername')
     if not options.twitter_pwd:
         raise Exception('You must provide a twitter password, i.e.: -p mytwitterpassword')
-    tt = TastyTweeter(
+    start_plan(options)
+    tt = get_tweeter_class(options)(
         twitter_user = options.twitter_user,
         twitter_pwd = options.twitter_pwd,
         backtweets_key = options.backtweets_key,
         delicious_user = options.delicious_user,
         tags = options.tags.split(' '),
         status_data = options.status_data,
-        queue_dir = options.queue_dir
+        state_store = options.plan_state_store,
+        clock = options.plan_clock or time.time,
+        queue_dir = options.queue_dir,
+        concurrency = options.concurrency,
+        max_pages = options.max_pages,
+        budget = options.budget,
+        reconcile_delay = options.reconcile_delay,
+        transport = get_transport(options),
+        cache_dir = options.cache_dir,
+        segment_queue = options.segment_queue,
+        metrics = options.metrics
     )
     # clear the empty and done folders whilst we're here
-    tt.cleanup_queue()
+    tt.cleanup_queue(max_seconds=options.cleanup_time)
     # generate the new follow requests
-    following = tt.follow()
-    # if we picked up any users
-    if following: 
+    try:
+        following = tt.follow()
+    finally:
+        finish_plan(options)
+    write_metrics(options)
+    # if we picked up any users and aren't leaving them for the drainer (or
+    # just planning)
+    if following and not options.drain and not options.plan: 
         # then start pushing them to twitter
-        push()
+        push(options)
     return following
 
 
-def push():
+def push(options=None):
     # try to push a request up to twitter
-    options = parse_options()
-    tt = TastyTweeter(queue_dir = options.queue_dir)
+    if options is None:
+        options = parse_options()
+    # most ticks find the queue empty, so check that before anything else
+    if is_queue_marked_empty(options.queue_dir):
+        return None
+    import crontab
+    if not options.twitter_user:
+        raise Exception('You must provide a twitter username, i.e.: -u mytwitterusername')
+    if not options.twitter_pwd:
+        raise Exception('You must provide a twitter password, i.e.: -p mytwitterpassword')
+    tt = TastyTweeter(
+        twitter_user = options.twitter_user,
+        twitter_pwd = options.twitter_pwd,
+        queue_dir = options.queue_dir,
+        transport = get_transport(options),
+        segment_queue = options.segment_queue,
+        metrics = options.metrics
+    )
     response = tt.push()
+    write_metrics(options)
     # update the user's crontab according to the response:
     tab = crontab.CronTab()
     absolute_path_to_bin_folder = os.path.abspath(os.path.dirname(sys.argv[0]))
@@ -480,9 +1556,102 @@ def push():
     return response
 
 
+def drain():
+    # push all the queued requests from this process, rather than one
+    # request per cronjob
+    options = parse_options()
+    if not options.twitter_user:
+        raise Exception('You must provide a twitter username, i.e.: -u mytwitterusername')
+    if not options.twitter_pwd:
+        raise Exception('You must provide a twitter password, i.e.: -p mytwitterpassword')
+    tt = TastyTweeter(
+        twitter_user = options.twitter_user,
+        twitter_pwd = options.twitter_pwd,
+        queue_dir = options.queue_dir,
+        transport = get_transport(options),
+        segment_queue = options.segment_queue,
+        metrics = options.metrics
+    )
+    responses = tt.drain(
+        rate_limit = options.rate_limit,
+        forever = options.forever,
+        idle_delay = options.push_delay
+    )
+    write_metrics(options)
+    return responses
+
+
+def multi():
+    # follow and then push for each of the profiles in the config file
+    from multi import MultiTweeter, load_profiles, CONFIG_FILE
+    options = parse_options()
+    mt = MultiTweeter(
+        load_profiles(options.config or CONFIG_FILE),
+        transport = get_transport(options),
+        cache_dir = options.cache_dir,
+        rate_limit = options.rate_limit,
+        metrics = options.metrics
+    )
+    mt.cleanup_queues(max_seconds=options.cleanup_time)
+    following = mt.follow()
+    mt.drain(forever=options.forever, idle_delay=options.push_delay)
+    write_metrics(options)
+    return following
+
+
+def daemon():
+    # follow and push from one long running process, instead of cronjobs
+    from daemon import Daemon, PID_FILE
+    options = parse_options()
+    if not options.backtweets_key:
+        raise Exception('You must provide a http://backtweets.com/api key, i.e.: -k KEY')
+    if not options.twitter_user:
+        raise Exception('You must provide a twitter username, i.e.: -u mytwitterusername')
+    if not options.twitter_pwd:
+        raise Exception('You must provide a twitter password, i.e.: -p mytwitterpassword')
+    # the daemon replaces any cronjobs tastytweets-automate set up
+    import crontab
+    tab = crontab.CronTab()
+    absolute_path_to_bin_folder = os.path.abspath(os.path.dirname(sys.argv[0]))
+    push = os.path.join(absolute_path_to_bin_folder, 'tastytweets-push')
+    follow = os.path.join(absolute_path_to_bin_folder, 'tastytweets-follow')
+    if tab.find_command(push) or tab.find_command(follow):
+        tab.remove_all(push)
+        tab.remove_all(follow)
+        tab.write()
+    tt = get_tweeter_class(options)(
+        twitter_user = options.twitter_user,
+        twitter_pwd = options.twitter_pwd,
+        backtweets_key = options.backtweets_key,
+        delicious_user = options.delicious_user,
+        tags = options.tags.split(' '),
+        status_data = options.status_data,
+        queue_dir = options.queue_dir,
+        concurrency = options.concurrency,
+        max_pages = options.max_pages,
+        budget = options.budget,
+        reconcile_delay = options.reconcile_delay,
+        transport = get_transport(options),
+        cache_dir = options.cache_dir,
+        segment_queue = options.segment_queue,
+        metrics = options.metrics
+    )
+    d = Daemon(
+        tt,
+        follow_delay = options.follow_delay,
+        rate_limit = options.rate_limit,
+        idle_delay = options.push_delay,
+        cleanup_time = options.cleanup_time,
+        pid_file = options.pid_file or PID_FILE,
+        report = lambda: write_metrics(options)
+    )
+    return d.run()
+
+
 def reset():
     options = parse_options()
     # kill any crontabs
+    import crontab
     tab = crontab.CronTab()
     absolute_path_to_bin_folder = os.path.abspath(os.path.dirname(sys.argv[0]))
     push = os.path.join(absolute_path_to_bin_folder, 'tastytweets-push')
@@ -491,14 +1660,22 @@ def reset():
     tab.remove_all(follow)
     tab.write()
     # reset the status_id and queue
-    tt = TastyTweeter(queue_dir = options.queue_dir)
+    tt = TastyTweeter(
+        status_data = options.status_data,
+        queue_dir = options.queue_dir,
+        segment_queue = options.segment_queue
+    )
     return tt.reset()
 
 
 def reset_status_id():
     options = parse_options()
     # reset the status_id
-    tt = TastyTweeter(queue_dir = options.queue_dir)
+    tt = TastyTweeter(
+        status_data = options.status_data,
+        queue_dir = options.queue_dir,
+        segment_queue = options.segment_queue
+    )
     return tt.reset_status_id()
 
 
@@ -515,6 +1692,7 @@ def automate():
     absolute_path_to_bin_folder = os.path.abspath(os.path.dirname(sys.argv[0]))
     follow_script = os.path.join(absolute_path_to_bin_folder, 'tastytweets-follow')
     push_script = os.path.join(absolute_path_to_bin_folder, 'tastytweets-push')
+    import crontab
     if crontab is not None:
         tab = crontab.CronTab()
         # remove existing
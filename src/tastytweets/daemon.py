@@ -0,0 +1,182 @@
+import errno
+import fcntl
+import os
+import signal
+import sys
+import time
+import traceback
+
+from client import CLEANUP_TIME, FOLLOW_DELAY, PUSH_DELAY, RATE_LIMIT, TWITTER_FOLLOW_URL
+from ratelimit import TokenBucket
+
+
+PID_FILE = os.path.expanduser(
+    '~/.tastytweets.pid'
+)
+
+SLEEP_STEP = 1 # seconds between checking whether we've been told to stop
+
+
+class PidLock(object):
+    """
+      
+      Holds an exclusive lock on the file at ``path`` and writes our pid into
+      it, so only one daemon runs against a queue at a time::
+          
+          >>> lock = PidLock('/tmp/tastytweets.pid')
+          >>> lock.acquire()
+          >>> PidLock('/tmp/tastytweets.pid').acquire()
+          Traceback (most recent call last):
+          ...
+          Exception: tastytweets is already running (pid ...)
+      
+      The lock goes with the process, so a daemon that's killed outright
+      doesn't leave a stale lock behind.
+      
+      
+    """
+    
+    def acquire(self):
+        sock = open(self.path, 'a+')
+        try:
+            fcntl.flock(sock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            sock.seek(0)
+            pid = sock.read().strip()
+            sock.close()
+            raise Exception('tastytweets is already running (pid %s)' % pid)
+        sock.truncate(0)
+        sock.write('%d\n' % os.getpid())
+        sock.flush()
+        self.sock = sock
+    
+    def release(self):
+        if self.sock is not None:
+            # empty it rather than delete it, so no one can lock a file
+            # that's about to disappear
+            self.sock.truncate(0)
+            self.sock.close()
+            self.sock = None
+    
+    
+    def __init__(self, path=PID_FILE):
+        self.path = path
+        self.sock = None
+
+
+
+
+class Daemon(object):
+    """
+      
+      Runs a ``TastyTweeter`` in one long lived process, instead of from the
+      cronjobs ``tastytweets-automate`` sets up: it follows every
+      ``follow_delay`` hours and pushes the queued follow requests as they
+      come, no faster than ``rate_limit`` an hour (or twitter's limit, once
+      it's told us), in between::
+          
+          >>> daemon = Daemon(tt)
+          >>> daemon.run() # until it gets a SIGTERM or SIGINT
+          {'follow': 4, 'push: OK': 112}
+      
+      On a ``SIGTERM`` or ``SIGINT`` it finishes what it's doing, releases its
+      pid file and returns how many times it followed and got each push
+      response.  If a follow or push fails, it's tried again after
+      ``idle_delay`` minutes.  If given, ``report`` is called after each
+      follow and push (e.g.: to write out the metrics).
+      
+      
+    """
+    
+    def _handle_signal(self, signum, frame):
+        self.stopping = True
+    
+    def _sleep(self, seconds):
+        until = self.clock() + seconds
+        while not self.stopping:
+            remaining = until - self.clock()
+            if remaining <= 0:
+                break
+            self.sleep(min(remaining, SLEEP_STEP))
+    
+    
+    def _report(self):
+        if self.report is not None:
+            self.report()
+    
+    def _count(self, response):
+        self.responses[response] = self.responses.get(response, 0) + 1
+    
+    def _follow(self):
+        try:
+            self.tt.cleanup_queue(max_seconds=self.cleanup_time)
+            self.tt.follow()
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            return self.idle_delay * 60
+        self._count('follow')
+        return self.follow_delay * 60 * 60
+    
+    def _push(self):
+        # returns how long to wait before pushing again, or ``None`` if
+        # the queue is empty
+        backoff = self.tt.get_backoff(TWITTER_FOLLOW_URL)
+        wait = backoff.delay()
+        if not backoff.paced:
+            wait = max(wait, self.bucket.delay())
+        if wait:
+            return wait
+        try:
+            response = self.tt.push()
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            return self.idle_delay * 60
+        if response is None:
+            return None
+        if not backoff.paced:
+            self.bucket.consume()
+        self._count(response)
+        return 0
+    
+    
+    def run(self):
+        self.lock.acquire()
+        handlers = {}
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            handlers[signum] = signal.signal(signum, self._handle_signal)
+        try:
+            next_follow = self.clock()
+            while not self.stopping:
+                if self.clock() >= next_follow:
+                    next_follow = self.clock() + self._follow()
+                    self._report()
+                    continue
+                wait = self._push()
+                if wait == 0:
+                    self._report()
+                if wait is None:
+                    wait = next_follow - self.clock()
+                self._sleep(wait)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.lock.release()
+        return self.responses
+    
+    
+    def __init__(self, tt, follow_delay=FOLLOW_DELAY, rate_limit=RATE_LIMIT, idle_delay=PUSH_DELAY, cleanup_time=CLEANUP_TIME, pid_file=PID_FILE, report=None, clock=time.time, sleep=time.sleep):
+        self.tt = tt
+        self.follow_delay = follow_delay
+        self.idle_delay = idle_delay
+        self.cleanup_time = cleanup_time
+        self.bucket = TokenBucket(rate_limit, per=3600, clock=clock, sleep=sleep)
+        self.lock = PidLock(pid_file)
+        self.report = report
+        self.clock = clock
+        self.sleep = sleep
+        self.stopping = False
+        self.responses = {}
+
+
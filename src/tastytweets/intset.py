@@ -0,0 +1,75 @@
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+
+
+# how many ids to hold in the python set before merging them into the array,
+# or a quarter of the ids in the array, whichever is more
+MERGE_THRESHOLD = 1024
+
+
+class IntSet(object):
+    """
+      
+      A compact set of integer ids, like the ids of the twitter users an
+      account is following.
+      
+      Most of the ids live in a sorted ``array`` of machine longs, which takes
+      8 bytes an id rather than the ~70 a python ``set`` does, and is searched
+      with ``bisect``.  Ids added since the last merge go in a plain ``set``,
+      which is folded into the array once it gets past ``MERGE_THRESHOLD`` (or
+      a quarter of the size of the array, so adding ids one at a time costs
+      o(log n) each).  To build one from a lot of ids, e.g.: an ``array`` of
+      them, pass them to the constructor, which sorts them once, rather than
+      adding them one at a time::
+          
+          >>> ids = IntSet([3, 1, 2, 3])
+          >>> len(ids)
+          3
+          >>> 2 in ids, 4 in ids
+          (True, False)
+          >>> ids.add(4)
+          >>> list(ids)
+          [1, 2, 3, 4]
+      
+      
+    """
+    
+    def _merge(self):
+        items = self._sorted.tolist()
+        items.extend(self._added)
+        items.sort()
+        self._sorted = array('l', items)
+        self._added = set()
+    
+    def __contains__(self, i):
+        if i in self._added:
+            return True
+        index = bisect_left(self._sorted, i)
+        return index < len(self._sorted) and self._sorted[index] == i
+    
+    def __len__(self):
+        return len(self._sorted) + len(self._added)
+    
+    def __iter__(self):
+        self._merge()
+        return iter(self._sorted)
+    
+    
+    def add(self, i):
+        if not i in self:
+            self._added.add(i)
+            if len(self._added) > max(MERGE_THRESHOLD, len(self._sorted) / 4):
+                self._merge()
+    
+    def update(self, items):
+        for i in items:
+            self.add(i)
+    
+    
+    def __init__(self, items=()):
+        # sort and dedupe the initial ids in one go, without the overhead
+        # of a set of them (repeats are next to each other once sorted)
+        self._sorted = array('l', [i for i, repeats in groupby(sorted(items))])
+        self._added = set()
+
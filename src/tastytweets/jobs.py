@@ -0,0 +1,52 @@
+import pickle
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+JOB_VERSION = 1
+
+
+def new_job(user_id, username):
+    """
+      
+      Returns a follow job for the twitter user ``user_id``, ``username``.
+      
+      
+    """
+    return {
+        'v': JOB_VERSION,
+        'user_id': user_id,
+        'username': username,
+        'errors': 0,
+        'queued': int(time.time())
+    }
+
+
+def encode_job(job):
+    """
+      
+      Returns the one line json record we store for ``job`` in the queue.
+      The http request is rebuilt from it when the job is pushed.
+      
+      Jobs queued by versions up to 0.2.2 are pickled dicts holding the whole
+      ``urllib2.Request``, which are pickled again.
+      
+      
+    """
+    if 'request' in job:
+        return pickle.dumps(job)
+    return json.dumps(job, separators=(',', ':'))
+
+
+def decode_job(data):
+    if not data.startswith('{'):
+        return pickle.loads(data)
+    job = json.loads(data)
+    if job.get('v', 0) > JOB_VERSION:
+        raise ValueError('Unknown follow job version: %s' % job['v'])
+    return job
+
@@ -0,0 +1,160 @@
+import re
+
+from array import array
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+CHUNK_SIZE = 16 * 1024
+
+TOKEN = re.compile(r'["\[\]{},:]')
+STRING_END = re.compile(r'["\\]')
+
+
+def iter_array(sock, key=None, chunk_size=CHUNK_SIZE):
+    """
+      
+      Yields the items of a json array as they're read from ``sock``, rather
+      than parsing the whole response first, as ``json.load`` does.  If ``key``
+      is ``None``, the response should be an array, e.g.: a list of following
+      ids::
+          
+          >>> list(iter_array(StringIO('[1, 2, 3]')))
+          [1, 2, 3]
+      
+      Otherwise, the response should be an object and the items come from
+      the array at ``key``, e.g.: the tweets in a backtweets search::
+          
+          >>> list(iter_array(StringIO('{"n": 1, "tweets": [{"a": 1}]}'), 'tweets'))
+          [{u'a': 1}]
+      
+      Only one item is held in memory at a time.  Once the array has been
+      read, the rest of the response is read and ``sock`` is closed.
+      
+      
+    """
+    buffer = ''
+    pos = 0
+    depth = 0
+    in_string = False
+    string_start = None
+    # the last string and the last key we've seen in the top level object
+    last_string = None
+    current_key = None
+    # the depth of the items we're yielding and where the current one starts
+    target = None
+    item_start = None
+    done = False
+    try:
+        while not done:
+            chunk = sock.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+            while not done:
+                if in_string:
+                    match = STRING_END.search(buffer, pos)
+                    if match is None:
+                        pos = len(buffer)
+                        break
+                    if match.group() == '\\':
+                        if match.end() == len(buffer):
+                            # the escaped char is in the next chunk
+                            pos = match.start()
+                            break
+                        pos = match.end() + 1
+                        continue
+                    in_string = False
+                    pos = match.end()
+                    if depth == 1 and target is None:
+                        last_string = buffer[string_start + 1:match.start()]
+                    continue
+                match = TOKEN.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                char = match.group()
+                pos = match.end()
+                if char == '"':
+                    in_string = True
+                    string_start = match.start()
+                elif char == ':':
+                    if depth == 1:
+                        current_key = last_string
+                elif char == ',':
+                    if depth == target:
+                        yield json.loads(buffer[item_start:match.start()])
+                        item_start = pos
+                    elif depth == 1:
+                        current_key = None
+                elif char in '[{':
+                    if target is None and char == '[':
+                        if key is None and depth == 0 or key is not None and depth == 1 and current_key == key:
+                            target = depth + 1
+                            item_start = pos
+                    depth += 1
+                else:
+                    depth -= 1
+                    if target is not None and depth == target - 1:
+                        item = buffer[item_start:match.start()]
+                        if item.strip():
+                            yield json.loads(item)
+                        done = True
+            
+            # throw away what we've finished with
+            keep = pos
+            if item_start is not None and not done:
+                keep = min(keep, item_start)
+            if in_string:
+                keep = min(keep, string_start)
+            buffer = buffer[keep:]
+            pos -= keep
+            if item_start is not None:
+                item_start -= keep
+            if in_string:
+                string_start -= keep
+        
+        # read to the end, so the connection can be used again
+        if done:
+            while sock.read(chunk_size):
+                pass
+    
+    finally:
+        sock.close()
+
+
+def read_int_array(sock, chunk_size=CHUNK_SIZE):
+    """
+      
+      Reads a json array of integers, e.g.: a list of following ids, from
+      ``sock`` into an ``array`` of machine longs, a chunk at a time::
+          
+          >>> read_int_array(StringIO('[1, 2, 3]'))
+          array('l', [1, 2, 3])
+      
+      This is much quicker than ``iter_array``, which parses each item on its
+      own, and only holds the array and a chunk of the response in memory.
+      ``sock`` is closed once it's been read.
+      
+      
+    """
+    ids = array('l')
+    rest = ''
+    try:
+        while True:
+            chunk = sock.read(chunk_size)
+            if not chunk:
+                break
+            # the last number may carry on in the next chunk
+            items = (rest + chunk.translate(None, '[]')).split(',')
+            rest = items.pop()
+            ids.extend(map(int, items))
+        
+        if rest.strip():
+            ids.append(int(rest))
+    finally:
+        sock.close()
+    return ids
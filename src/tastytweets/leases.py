@@ -0,0 +1,84 @@
+import fcntl
+import os
+import random
+import sys
+import time
+
+
+LEASE_TIME = 10 * 60 # seconds a worker has to deal with an item it's claimed
+
+LOCK_FILE = 'lock'
+
+
+def new_lease(lease_time=LEASE_TIME):
+    """
+      
+      Returns ``(token, expires)`` for a new lease, where ``token`` tells this
+      claim apart from any other and ``expires`` is when it runs out.
+      
+      
+    """
+    token = '%d-%d' % (os.getpid(), random.randint(0, sys.maxint))
+    return token, time.time() + lease_time
+
+
+def write_lease(path, lease, data=''):
+    # write it in one go, so no one reads it half written
+    tmp_path = '%s.tmp' % path
+    sock = open(tmp_path, 'w')
+    sock.write('%s %f\n%s' % (lease[0], lease[1], data))
+    sock.close()
+    os.rename(tmp_path, path)
+
+
+def read_lease(path):
+    """
+      
+      Returns ``(token, expires, data)`` from the lease file at ``path``, or
+      ``None`` if there isn't one.
+      
+      
+    """
+    if not os.path.exists(path):
+        return None
+    sock = open(path, 'r')
+    header = sock.readline()
+    data = sock.read()
+    sock.close()
+    token, expires = header.split()
+    return token, float(expires), data
+
+
+class QueueLock(object):
+    """
+      
+      An exclusive lock on the file at ``path``, held while a queue is read
+      or changed, so several processes can push from the same queue without
+      claiming the same item or losing each other's updates::
+          
+          >>> lock = QueueLock('/tmp/queue/lock')
+          >>> lock.acquire() # blocks until no one else holds it
+          >>> lock.release()
+      
+      Each ``QueueLock`` opens the file for itself, so threads should each
+      use their own.
+      
+      
+    """
+    
+    def acquire(self):
+        sock = open(self.path, 'a')
+        fcntl.flock(sock.fileno(), fcntl.LOCK_EX)
+        self.sock = sock
+    
+    def release(self):
+        if self.sock is not None:
+            fcntl.flock(self.sock.fileno(), fcntl.LOCK_UN)
+            self.sock.close()
+            self.sock = None
+    
+    
+    def __init__(self, path):
+        self.path = path
+        self.sock = None
+
@@ -0,0 +1,129 @@
+import threading
+import time
+import urllib
+import urlparse
+
+
+LOOKUP_TTL = 15 * 60 # seconds
+MAX_LOOKUPS = 1000
+
+# query params that say where a link was shared, not what it links to
+TRACKING_PARAMS = ('fbclid', 'gclid')
+
+
+def normalize_url(url):
+    """
+      
+      Normalizes ``url``, so that urls that point at the same page are looked
+      up on backtweets once: lower cases the scheme and host, drops default
+      ports, the fragment, a trailing slash and any ``utm_*`` or other
+      tracking params::
+          
+          >>> normalize_url('HTTP://Example.com:80/foo/?utm_source=x&a=1#top')
+          'http://example.com/foo?a=1'
+      
+      
+    """
+    parts = urlparse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if scheme == 'http' and netloc.endswith(':80'):
+        netloc = netloc[:-3]
+    elif scheme == 'https' and netloc.endswith(':443'):
+        netloc = netloc[:-4]
+    path = parts.path.rstrip('/')
+    query = parts.query
+    if query:
+        params = urlparse.parse_qsl(query, keep_blank_values=True)
+        kept = [(k, v) for k, v in params if not (
+                k.lower().startswith('utm_') or k.lower() in TRACKING_PARAMS
+            )
+        ]
+        if len(kept) < len(params):
+            query = urllib.urlencode(kept)
+        
+    return urlparse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+class LookupCache(object):
+    """
+      
+      Remembers the results of backtweets searches, so that ``TastyTweeter``s
+      sharing one (e.g.: the profiles run by a ``MultiTweeter``), or a run that
+      is retried, only search for a (normalized) url once when they're looking
+      from the same status id::
+          
+          >>> lookups = LookupCache()
+          >>> lookups.get(('http://a.com', 0, 1, 10), fetch)
+          ([...], {})
+      
+      ``fetch`` is only called if the key isn't there yet and should return
+      ``(tweets, progress)``.  If several threads ask for the same key at once,
+      only the first one fetches it; the others wait for its result.
+      
+      Results are forgotten after ``ttl`` seconds, so a url with no new tweets
+      is searched for again, and once there are more than ``max_size`` results,
+      the least recently used ones are dropped.
+      
+      
+    """
+    
+    def get(self, key, fetch):
+        self._lock.acquire()
+        try:
+            entry = self._results.get(key)
+            if entry is not None:
+                if time.time() - entry[0] < self.ttl:
+                    entry[1] = self._next_use()
+                    return entry[2]
+                del self._results[key]
+            event = self._fetching.get(key)
+            if event is None:
+                self._fetching[key] = threading.Event()
+        finally:
+            self._lock.release()
+        if event is not None:
+            event.wait()
+            return self.get(key, fetch)
+        result = None
+        try:
+            result = fetch()
+        finally:
+            self._lock.acquire()
+            try:
+                if result is not None:
+                    self._results[key] = [time.time(), self._next_use(), result]
+                    self._evict()
+                event = self._fetching.pop(key)
+            finally:
+                self._lock.release()
+            event.set()
+        return result
+    
+    def _next_use(self):
+        self._uses += 1
+        return self._uses
+    
+    def _evict(self):
+        while len(self._results) > self.max_size:
+            least_used = min(self._results.items(), key=lambda item: item[1][1])
+            del self._results[least_used[0]]
+        
+    
+    
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._results = {}
+        finally:
+            self._lock.release()
+    
+    
+    def __init__(self, ttl=LOOKUP_TTL, max_size=MAX_LOOKUPS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._uses = 0
+        self._results = {}
+        self._fetching = {}
+        self._lock = threading.Lock()
+
@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # seconds
+
+PREFIX = 'tastytweets_'
+
+
+def _write_file(path, data):
+    # write it in one go, so nothing reads it half written
+    tmp_path = '%s.tmp' % path
+    sock = open(tmp_path, 'w')
+    sock.write(data)
+    sock.close()
+    os.rename(tmp_path, path)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (k, v) for k, v in pairs])
+
+
+class NullMetrics(object):
+    """
+      
+      Does nothing, so a ``TastyTweeter`` without metrics doesn't have to check.
+      
+      
+    """
+    
+    def incr(self, name, value=1, **labels):
+        pass
+    
+    def observe(self, name, seconds, **labels):
+        pass
+
+
+
+
+
+class Metrics(object):
+    """
+      
+      Counts things and keeps histograms of how long they took, by name and
+      labels::
+          
+          >>> metrics = Metrics()
+          >>> metrics.incr('requests', endpoint='backtweets', status='200')
+          >>> metrics.observe('request_seconds', 0.2, endpoint='backtweets')
+          >>> metrics.summary()['counters'][0]['value']
+          1
+      
+      Pass one to a ``TastyTweeter`` and it records its requests (by endpoint
+      and status), the time each takes to respond (up to its headers, as the
+      bodies are read as they stream in), the time spent in each phase of a
+      run (with ``get_users_for_site`` timing each url's backtweets pages,
+      bodies and all) and in each queue operation and state commit.  Write them out with
+      ``write_json`` or, for prometheus' node exporter to pick up, with
+      ``write_textfile``.
+      
+      
+    """
+    
+    def _key(self, name, labels):
+        items = labels.items()
+        items.sort()
+        return name, tuple(items)
+    
+    
+    def incr(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self._lock.acquire()
+        try:
+            self.counters[key] = self.counters.get(key, 0) + value
+        finally:
+            self._lock.release()
+    
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        self._lock.acquire()
+        try:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'count': 0,
+                    'sum': 0.0,
+                    'buckets': [0] * len(self.buckets)
+                }
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+        finally:
+            self._lock.release()
+    
+    
+    def summary(self):
+        """
+          
+          Returns the counters and histograms as a dict, with each histogram's
+          bucket counts cumulative, keyed by their upper bounds.
+          
+          
+        """
+        self._lock.acquire()
+        try:
+            counters = []
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.append({'name': name, 'labels': dict(labels), 'value': value})
+            histograms = []
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                total = 0
+                buckets = []
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    total += count
+                    buckets.append((bound, total))
+                histograms.append({
+                        'name': name,
+                        'labels': dict(labels),
+                        'count': histogram['count'],
+                        'sum': histogram['sum'],
+                        'buckets': buckets
+                    }
+                )
+        finally:
+            self._lock.release()
+        return {
+            'started': self.started,
+            'finished': time.time(),
+            'counters': counters,
+            'histograms': histograms
+        }
+    
+    def write_json(self, path):
+        _write_file(path, json.dumps(self.summary()))
+    
+    def write_textfile(self, path):
+        """
+          
+          Writes the metrics to ``path`` in prometheus' text format, with each
+          name prefixed ``tastytweets_`` and the counters suffixed ``_total``.
+          
+          
+        """
+        summary = self.summary()
+        lines = []
+        # the counters and histograms are sorted by name, so each name's
+        # samples follow its type
+        typed = set()
+        def add_type(name, kind):
+            if not name in typed:
+                typed.add(name)
+                lines.append('# TYPE %s %s' % (name, kind))
+        for counter in summary['counters']:
+            add_type('%s%s_total' % (PREFIX, counter['name']), 'counter')
+            lines.append('%s%s_total%s %s' % (
+                    PREFIX,
+                    counter['name'],
+                    _format_labels(sorted(counter['labels'].items())),
+                    counter['value']
+                )
+            )
+        for histogram in summary['histograms']:
+            name = PREFIX + histogram['name']
+            labels = sorted(histogram['labels'].items())
+            add_type(name, 'histogram')
+            for bound, count in histogram['buckets']:
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', bound)]), count))
+            lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', '+Inf')]), histogram['count']))
+            lines.append('%s_sum%s %f' % (name, _format_labels(labels), histogram['sum']))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), histogram['count']))
+        add_type('%slast_run_timestamp_seconds' % PREFIX, 'gauge')
+        lines.append('%slast_run_timestamp_seconds %d' % (PREFIX, summary['finished']))
+        _write_file(path, '\n'.join(lines) + '\n')
+    
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+
+
+
+class InstrumentedQueue(object):
+    """
+      
+      Wraps a queue, timing each of its methods as ``queue_seconds``, labelled
+      with the name of the method.
+      
+      
+    """
+    
+    def __getattr__(self, name):
+        attr = getattr(self.queue, name)
+        if not callable(attr):
+            return attr
+        def timed(*args, **kwargs):
+            started = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.metrics.observe('queue_seconds', time.time() - started, op=name)
+        return timed
+    
+    
+    def __init__(self, queue, metrics):
+        self.queue = queue
+        self.metrics = metrics
+
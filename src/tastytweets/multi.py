@@ -0,0 +1,215 @@
+import os
+import sys
+import time
+import traceback
+
+from ConfigParser import RawConfigParser
+
+from client import TastyTweeter, CACHE_DIR, PUSH_DELAY, RATE_LIMIT, TWITTER_FOLLOW_URL
+from lookups import LookupCache
+from ratelimit import TokenBucket
+from transport import HTTPTransport
+
+
+CONFIG_FILE = os.path.expanduser(
+    '~/.tastytweets.cfg'
+)
+
+# profile options that aren't strings
+INT_OPTIONS = ('concurrency', 'max_pages', 'budget', 'reconcile_delay', 'rate_limit')
+BOOLEAN_OPTIONS = ('segment_queue',)
+
+
+def load_profiles(path=CONFIG_FILE):
+    """
+      
+      Reads the profiles in the config file at ``path``.  Each section is a
+      profile, named after the section, with the same options as a
+      ``TastyTweeter`` takes, plus a ``rate_limit`` for pushing its follow
+      requests.  Options in the ``[DEFAULT]`` section apply to every profile::
+          
+          [DEFAULT]
+          backtweets_key = KEY
+          
+          [me]
+          twitter_user = me
+          twitter_pwd = secret
+          tags = follow python
+          
+          [work]
+          twitter_user = work
+          twitter_pwd = secret
+          delicious_user = me
+          tags = follow django
+      
+      Unless they're given, each profile keeps its status data and queue at
+      ``~/.tastytweets-<name>-status.db`` and ``~/.tastytweets-<name>-queue``.
+      
+      
+    """
+    parser = RawConfigParser()
+    if not parser.read(path):
+        raise Exception('Couldn\'t read the config file: %s' % path)
+    profiles = []
+    for name in parser.sections():
+        profile = {
+            'name': name,
+            'status_data': os.path.expanduser('~/.tastytweets-%s-status.db' % name),
+            'queue_dir': os.path.expanduser('~/.tastytweets-%s-queue' % name)
+        }
+        for option in parser.options(name):
+            if option in INT_OPTIONS:
+                profile[option] = parser.getint(name, option)
+            elif option in BOOLEAN_OPTIONS:
+                profile[option] = parser.getboolean(name, option)
+            else:
+                profile[option] = parser.get(name, option)
+        
+        if 'tags' in profile:
+            profile['tags'] = profile['tags'].split(' ')
+        for option in ('status_data', 'queue_dir'):
+            profile[option] = os.path.expanduser(profile[option])
+        
+        profiles.append(profile)
+    
+    return profiles
+
+
+class MultiTweeter(object):
+    """
+      
+      Runs several profiles (see ``load_profiles``) from the one process::
+          
+          >>> mt = MultiTweeter(load_profiles())
+          >>> mt.follow()
+          {'me': [...], 'work': [...]}
+          >>> mt.drain()
+          {'me': {'push: OK': 12}, 'work': {'push: OK': 3}}
+      
+      The profiles share an http transport, so they share its connections,
+      and the delicious feed cache.  They also share backtweets searches (for
+      the ``LookupCache``'s ttl): a url that several profiles have tagged is
+      only searched for once, as long as they're looking from the same status
+      id (which they will be, after their first run together).
+      
+      If ``find`` or ``follow`` fails for a profile, the error is printed to
+      stderr, the profile's result is ``None`` and the other profiles carry
+      on regardless.  A profile that can't be set up at all (e.g.: it has an
+      option a ``TastyTweeter`` doesn't take) is reported the same way and
+      left out.
+      
+      ``drain`` pushes the profiles' follow requests in turn, one each, each
+      within its own ``rate_limit`` (or twitter's, once it's told us) and
+      backing off on its own, so no one account holds up the others.  If a
+      profile's push fails, it's reported and the profile is skipped while
+      the others carry on, until the next time the queues are checked when
+      they're all empty (see ``drain``).
+      
+      
+    """
+    
+    def _report(self, action, name):
+        # prints the error being handled, so one profile falling over
+        # doesn't stop the others
+        print >> sys.stderr, 'tastytweets: %s failed for profile %r' % (action, name)
+        traceback.print_exc(file=sys.stderr)
+    
+    def _each(self, method, **kwargs):
+        results = {}
+        for name, tt, rate_limit in self.tweeters:
+            try:
+                results[name] = getattr(tt, method)(**kwargs)
+            except Exception:
+                self._report(method, name)
+                results[name] = None
+        return results
+    
+    
+    def find(self):
+        return self._each('find')
+    
+    def follow(self):
+        return self._each('follow')
+    
+    def cleanup_queues(self, max_seconds=None):
+        self._each('cleanup_queue', max_seconds=max_seconds)
+    
+    
+    def drain(self, forever=False, idle_delay=PUSH_DELAY):
+        """
+          
+          Pushes the queued follow requests of all the profiles, taking turns,
+          until all the queues are empty or, if ``forever`` is true, for ever,
+          checking the queues every ``idle_delay`` minutes once they're empty.
+          Returns a dict of each profile's push responses.
+          
+          A profile whose push fails is left out until then, or for the rest
+          of the drain, if ``forever`` isn't true.
+          
+          
+        """
+        buckets = [TokenBucket(rate_limit, per=3600) for name, tt, rate_limit in self.tweeters]
+        responses = dict([(name, {}) for name, tt, rate_limit in self.tweeters])
+        failed = set()
+        while True:
+            pushed = False
+            waits = []
+            for (name, tt, rate_limit), bucket in zip(self.tweeters, buckets):
+                if name in failed:
+                    continue
+                backoff = tt.get_backoff(TWITTER_FOLLOW_URL)
+                wait = backoff.delay()
+                if not backoff.paced:
+                    wait = max(wait, bucket.delay())
+                if wait:
+                    waits.append(wait)
+                    continue
+                try:
+                    response = tt.push()
+                except Exception:
+                    self._report('push', name)
+                    failed.add(name)
+                    continue
+                if response is None:
+                    continue
+                if not backoff.paced:
+                    bucket.consume()
+                counts = responses[name]
+                counts[response] = counts.get(response, 0) + 1
+                pushed = True
+            
+            if pushed:
+                continue
+            if waits:
+                # wait for the next account that can push
+                time.sleep(min(waits))
+            elif forever:
+                time.sleep(idle_delay * 60)
+                # give the profiles that failed another go
+                failed = set()
+            else:
+                break
+        
+        return responses
+    
+    
+    def __init__(self, profiles, transport=None, cache_dir=CACHE_DIR, rate_limit=RATE_LIMIT, metrics=None):
+        self.transport = transport and transport or HTTPTransport()
+        self.lookup_cache = LookupCache()
+        self.tweeters = []
+        for profile in profiles:
+            kwargs = profile.copy()
+            name = kwargs.pop('name')
+            profile_rate_limit = kwargs.pop('rate_limit', rate_limit)
+            kwargs.setdefault('cache_dir', cache_dir)
+            try:
+                tt = TastyTweeter(
+                    transport = self.transport,
+                    lookup_cache = self.lookup_cache,
+                    metrics = metrics,
+                    **kwargs
+                )
+            except Exception:
+                self._report('setup', name)
+                continue
+            self.tweeters.append((name, tt, profile_rate_limit))
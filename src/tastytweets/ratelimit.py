@@ -0,0 +1,223 @@
+import random
+import time
+
+
+BACKOFF_BASE = 60 # seconds
+BACKOFF_MAX = 60 * 60
+
+
+def get_header_delay(headers, now):
+    """
+      
+      Returns how many seconds the response ``headers`` ask us to wait, from
+      a ``Retry-After`` header (in seconds or an http date) or, if there are
+      no requests left, the ``X-RateLimit-Reset`` time, or ``None``.
+      
+      
+    """
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        retry_after = retry_after.strip()
+        if retry_after.isdigit():
+            return int(retry_after)
+        from email.utils import mktime_tz, parsedate_tz
+        parsed = parsedate_tz(retry_after)
+        if parsed is not None:
+            return max(0, mktime_tz(parsed) - now)
+    remaining, reset = get_rate_limit(headers)
+    if remaining == 0 and reset is not None:
+        return max(0, reset - now)
+    return None
+
+
+def get_rate_limit(headers):
+    """
+      
+      Returns the ``(remaining, reset)`` rate limit the response ``headers``
+      report, with ``None`` for any that aren't there.
+      
+      
+    """
+    values = []
+    for name in ('x-ratelimit-remaining', 'x-ratelimit-reset'):
+        try:
+            values.append(int(headers.get(name)))
+        except (TypeError, ValueError):
+            values.append(None)
+    return tuple(values)
+
+
+class TokenBucket(object):
+    """
+      
+      Paces calls to at most ``rate`` every ``per`` seconds, allowing bursts of
+      up to ``capacity`` calls.  Call ``consume`` before each call you want to
+      pace; it blocks until there's a token to take::
+          
+          >>> bucket = TokenBucket(100, per=3600)
+          >>> bucket.consume() # returns straight away
+          >>> round(bucket.delay()) # seconds until the next token
+          36.0
+      
+      ``clock`` and ``sleep`` default to ``time.time`` and ``time.sleep``.
+      
+      
+    """
+    
+    def _refill(self):
+        now = self.clock()
+        earned = (now - self.updated) * self.rate / self.per
+        self.tokens = min(self.capacity, self.tokens + earned)
+        self.updated = now
+    
+    def delay(self):
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) * self.per / self.rate
+    
+    def consume(self):
+        wait = self.delay()
+        if wait:
+            self.sleep(wait)
+            self._refill()
+        self.tokens -= 1
+    
+    
+    def __init__(self, rate, per=3600, capacity=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.per = float(per)
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        # start full, so the first call doesn't have to wait
+        self.tokens = capacity
+        self.updated = clock()
+
+
+
+
+class Backoff(object):
+    """
+      
+      Paces the requests to one endpoint by what its responses tell us.  Call
+      ``success`` or ``failure`` with the headers of each response and wait
+      ``delay`` seconds before the next request::
+          
+          >>> backoff = Backoff()
+          >>> backoff.failure({'retry-after': '120'})
+          >>> round(backoff.delay())
+          120.0
+      
+      Failures without a ``Retry-After`` back off exponentially from ``base``
+      up to ``max_delay`` seconds, with full jitter, so workers that fail
+      together don't all retry together.  Once a response has reported its
+      ``X-RateLimit-Remaining`` and ``X-RateLimit-Reset``, the requests left are
+      spread over the rest of the window and ``paced`` is true, so the caller
+      can use that instead of a fixed rate.
+      
+      
+    """
+    
+    def delay(self):
+        return max(0, self.until - self.clock())
+    
+    
+    def success(self, headers={}):
+        now = self.clock()
+        self.failures = 0
+        self.until = now
+        wait = get_header_delay(headers, now)
+        remaining, reset = get_rate_limit(headers)
+        if remaining and reset is not None:
+            self.paced = True
+            wait = max(wait or 0, (reset - now) / float(remaining))
+        if wait:
+            self.until = now + wait
+    
+    def failure(self, headers={}):
+        now = self.clock()
+        self.failures += 1
+        wait = get_header_delay(headers, now)
+        if wait is None:
+            ceiling = min(self.max_delay, self.base * 2 ** (self.failures - 1))
+            wait = self.random() * ceiling
+        self.until = now + wait
+    
+    
+    def __init__(self, base=BACKOFF_BASE, max_delay=BACKOFF_MAX, clock=time.time, random=random.random):
+        self.base = base
+        self.max_delay = max_delay
+        self.clock = clock
+        self.random = random
+        self.failures = 0
+        self.until = 0
+        self.paced = False
+
+
+
+
+class CallBudget(object):
+    """
+      
+      Counts the calls made to an API against a ``limit`` (``0`` for no limit).
+      Call ``spend`` before each call and don't make it if that returns false::
+          
+          >>> budget = CallBudget(2)
+          >>> budget.spend(), budget.spend(), budget.spend()
+          (True, True, False)
+      
+      Or, to share the calls out in a set order, rather than to whichever
+      thread asks first, ``reserve`` them up front::
+          
+          >>> budget = CallBudget(5)
+          >>> budget.reserve(1), budget.reserve(9), budget.reserve(1)
+          (1, 4, 0)
+      
+      It's safe to share between threads.
+      
+      
+    """
+    
+    def exhausted(self):
+        return bool(self.limit) and self.spent >= self.limit
+    
+    def spend(self):
+        self._lock.acquire()
+        try:
+            if self.exhausted():
+                return False
+            self.spent += 1
+            return True
+        finally:
+            self._lock.release()
+    
+    def reserve(self, count=None):
+        """
+          
+          Takes up to ``count`` calls (or all that are left, if ``count`` is
+          ``None``) out of the budget and returns how many it got, or ``count``
+          if there's no limit.
+          
+          
+        """
+        self._lock.acquire()
+        try:
+            if not self.limit:
+                return count
+            left = self.limit - self.spent
+            if count is not None:
+                left = min(left, count)
+            left = max(left, 0)
+            self.spent += left
+            return left
+        finally:
+            self._lock.release()
+    
+    
+    def __init__(self, limit=0):
+        import threading
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
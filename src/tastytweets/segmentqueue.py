@@ -0,0 +1,264 @@
+import os
+import time
+
+from leases import LEASE_TIME, LOCK_FILE, QueueLock, new_lease, read_lease, write_lease
+
+
+SEGMENT_SIZE = 1024 * 1024 # bytes
+
+CHUNK_SIZE = 64 * 1024
+
+
+class SegmentItem(object):
+    
+    def __init__(self, segment, offset, next_offset, data, lease=None):
+        self.segment = segment
+        self.offset = offset
+        self.next_offset = next_offset
+        self.data = data
+        self.lease = lease
+
+
+
+
+class SegmentQueue(object):
+    """
+      
+      A queue that keeps its items as lines in append-only segment files,
+      rather than a directory per item, as the ``ClearableDirectoryQueue`` does.
+      That's a lot fewer files (and a lot less ``listdir``ing) once thousands
+      of items are queued up.
+      
+      New items are appended to the last segment, and a new segment is
+      started once it gets past ``segment_size`` bytes.  The position of the
+      next item to process is kept in a ``position`` file.  Segments are
+      deleted once all of their items have been handed out.  Done and failed
+      items are appended to the ``done`` and ``error`` files.
+      
+      As with the ``ClearableDirectoryQueue``, ``getNext`` claims an item with
+      a lease of ``lease_time`` seconds, under a lock on the queue, so several
+      processes can push from it at once.  The item is kept in a lease file
+      until it's been dealt with, so if a process dies with an item in hand,
+      the item is queued again once its lease has run out.
+      
+      Items are strings without newlines.  It has the same methods as the
+      ``ClearableDirectoryQueue`` that a ``TastyTweeter`` uses, so the two can
+      be swapped::
+          
+          >>> queue = SegmentQueue('/tmp/queue')
+          >>> queue.put('foo', 'bar')
+          >>> item = queue.getNext()
+          >>> queue.getData(item)
+          'bar'
+          >>> queue.itemDone(item)
+          >>> queue.getNext() is None
+          True
+      
+      
+    """
+    
+    def _segment_path(self, segment):
+        return os.path.join(self.segments_dir, '%010d' % segment)
+    
+    def _segments(self):
+        return sorted([int(name) for name in os.listdir(self.segments_dir) if name.isdigit()])
+    
+    def _get_position(self):
+        if not os.path.exists(self.position_path):
+            segments = self._segments()
+            return segments and segments[0] or 0, 0
+        sock = open(self.position_path, 'r')
+        segment, offset = sock.read().split()
+        sock.close()
+        return int(segment), int(offset)
+    
+    def _set_position(self, segment, offset):
+        tmp_path = '%s.tmp' % self.position_path
+        sock = open(tmp_path, 'w')
+        sock.write('%d %d' % (segment, offset))
+        sock.close()
+        os.rename(tmp_path, self.position_path)
+    
+    def _append(self, path, data):
+        if '\n' in data:
+            raise ValueError('Queue items can\'t contain newlines')
+        sock = open(path, 'a')
+        sock.write('%s\n' % data)
+        sock.close()
+    
+    def _count_lines(self, path, offset=0):
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        sock = open(path, 'r')
+        sock.seek(offset)
+        chunk = sock.read(CHUNK_SIZE)
+        while chunk:
+            count += chunk.count('\n')
+            chunk = sock.read(CHUNK_SIZE)
+        sock.close()
+        return count
+    
+    def _lease_path(self, item):
+        return os.path.join(self.leases_dir, '%010d-%d' % (item.segment, item.offset))
+    
+    def _holds_lease(self, item):
+        if item.lease is None:
+            return False
+        current = read_lease(self._lease_path(item))
+        return current is not None and current[0] == item.lease[0]
+    
+    def _recover(self):
+        now = time.time()
+        for name in os.listdir(self.leases_dir):
+            if name.endswith('.tmp'):
+                # left over from a process that died as it claimed an item
+                continue
+            lease_path = os.path.join(self.leases_dir, name)
+            lease = read_lease(lease_path)
+            if lease is not None and lease[1] < now:
+                self._put(lease[2])
+                os.remove(lease_path)
+            
+        
+    
+    def _put(self, data):
+        segments = self._segments()
+        segment = segments and segments[-1] or 0
+        path = self._segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+            path = self._segment_path(segment + 1)
+        self._append(path, data)
+    
+    def _finish(self, item, path, requeue=False):
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            if not self._holds_lease(item):
+                return
+            # append it again before we let go of it, so it can't get lost
+            if requeue:
+                self._put(item.data)
+            if path is not None:
+                self._append(path, item.data)
+            os.remove(self._lease_path(item))
+            item.lease = None
+        finally:
+            lock.release()
+    
+    
+    def put(self, name, data):
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            self._put(data)
+        finally:
+            lock.release()
+    
+    def getNext(self):
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            self._recover()
+            segment, offset = self._get_position()
+            while True:
+                path = self._segment_path(segment)
+                line = ''
+                if os.path.exists(path):
+                    sock = open(path, 'r')
+                    sock.seek(offset)
+                    line = sock.readline()
+                    sock.close()
+                if line.endswith('\n'):
+                    item = SegmentItem(segment, offset, offset + len(line), line[:-1])
+                    # keep it in a lease file until it's been dealt with
+                    item.lease = new_lease(self.lease_time)
+                    write_lease(self._lease_path(item), item.lease, item.data)
+                    self._set_position(segment, item.next_offset)
+                    return item
+                later = [s for s in self._segments() if s > segment]
+                if not later:
+                    return None
+                # we're done with this segment
+                if os.path.exists(path):
+                    os.remove(path)
+                segment, offset = later[0], 0
+                self._set_position(segment, offset)
+        finally:
+            lock.release()
+    
+    
+    def getData(self, item):
+        return item.data
+    
+    def setData(self, item, data):
+        item.data = data
+    
+    
+    def itemDone(self, item):
+        self._finish(item, self.done_path)
+    
+    def itemRequeue(self, item):
+        self._finish(item, None, requeue=True)
+    
+    def itemError(self, item):
+        self._finish(item, self.error_path)
+    
+    
+    def _clear(self, path):
+        lock = QueueLock(self.lock_path)
+        lock.acquire()
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        finally:
+            lock.release()
+    
+    
+    def clearDone(self):
+        self._clear(self.done_path)
+    
+    def clearError(self):
+        self._clear(self.error_path)
+    
+    def purge(self, max_seconds=None):
+        # clearing deletes a file, so there's nothing left over
+        return True
+    
+    def clear(self, max_seconds=None):
+        self.clearDone()
+        self.clearError()
+        return True
+    
+    def stats(self):
+        segment, offset = self._get_position()
+        ready = 0
+        for s in self._segments():
+            if s >= segment:
+                ready += self._count_lines(
+                    self._segment_path(s),
+                    s == segment and offset or 0
+                )
+            
+        return {
+            'ready': ready,
+            'active': len(os.listdir(self.leases_dir)),
+            'done': self._count_lines(self.done_path),
+            'error': self._count_lines(self.error_path)
+        }
+    
+    
+    def __init__(self, path, segment_size=SEGMENT_SIZE, lease_time=LEASE_TIME):
+        self.path = path
+        self.segment_size = segment_size
+        self.lease_time = lease_time
+        self.segments_dir = os.path.join(path, 'segments')
+        self.leases_dir = os.path.join(path, 'leases')
+        self.position_path = os.path.join(path, 'position')
+        self.lock_path = os.path.join(path, LOCK_FILE)
+        self.done_path = os.path.join(path, 'done')
+        self.error_path = os.path.join(path, 'error')
+        for dir_path in (self.segments_dir, self.leases_dir):
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+
@@ -0,0 +1,264 @@
+import mimetools
+import mmap
+import os
+import re
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import zlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from StringIO import StringIO
+
+from transport import Transport
+
+
+MAGIC = 'tastytweets-snapshot 1\n'
+
+TRAILER = '%020d%020d' # offset and length of the index
+
+TRAILER_SIZE = 40
+
+# query params left out of the snapshot, so it doesn't hold the api key and
+# can be replayed with any other
+DROP_PARAMS = ('key',)
+
+# response headers that don't apply to the stored (decoded) body
+DROP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'set-cookie')
+
+
+class SnapshotMiss(urllib2.URLError):
+    pass
+
+
+def get_snapshot_key(request):
+    """
+      
+      Returns the key a response to ``request`` is stored under: its method
+      and url, without any of the ``DROP_PARAMS``.
+      
+      
+    """
+    url = request.get_full_url()
+    parts = urlparse.urlsplit(url)
+    if parts.query:
+        params = urlparse.parse_qsl(parts.query, keep_blank_values=True)
+        query = urllib.urlencode([(k, v) for k, v in params if not k in DROP_PARAMS])
+        url = urlparse.urlunsplit((parts.scheme, parts.netloc, parts.path, query, parts.fragment))
+    return '%s %s' % (request.get_method(), url)
+
+
+def make_response(url, code, headers, body):
+    response = urllib.addinfourl(StringIO(body), mimetools.Message(StringIO(headers)), url)
+    response.code = code
+    return response
+
+
+def write_snapshot(path, responses, state=None, started=None):
+    """
+      
+      Writes ``responses``, a dict of ``(code, headers, compressed_body)`` by
+      key (see ``get_snapshot_key``), and the ``state`` the run started from
+      (see ``SqliteStateStore.dump``) and when it ``started`` to the snapshot
+      file at ``path``.
+      
+      Each body is compressed on its own, followed by a compressed json index
+      of where each one is and the trailer saying where the index is, so a
+      ``Snapshot`` only has to decompress the responses it's asked for.
+      
+      
+    """
+    tmp_path = '%s.tmp' % path
+    sock = open(tmp_path, 'wb')
+    sock.write(MAGIC)
+    offset = len(MAGIC)
+    index = {}
+    for key, (code, headers, body) in sorted(responses.items()):
+        sock.write(body)
+        index[key] = [offset, len(body), code, headers]
+        offset += len(body)
+    created = time.time()
+    meta = zlib.compress(json.dumps({
+                'created': created,
+                'started': started or created,
+                'responses': index,
+                'state': state or []
+            }
+        )
+    )
+    sock.write(meta)
+    sock.write(TRAILER % (offset, len(meta)))
+    sock.close()
+    os.rename(tmp_path, path)
+
+
+class Snapshot(object):
+    """
+      
+      The responses and starting state saved in a snapshot file (see
+      ``write_snapshot``), which is memory mapped rather than read in::
+          
+          >>> snapshot = Snapshot('/tmp/plan.snapshot')
+          >>> code, headers, body = snapshot.get('GET http://...')
+      
+      ``get`` returns ``None`` for a request that isn't in the snapshot.
+      
+      
+    """
+    
+    def keys(self):
+        return self.index.keys()
+    
+    def get(self, key):
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        offset, length, code, headers = entry
+        return code, headers, zlib.decompress(self.data[offset:offset + length])
+    
+    def close(self):
+        self.data.close()
+        self.sock.close()
+    
+    
+    def __init__(self, path):
+        self.path = path
+        self.sock = open(path, 'rb')
+        self.data = mmap.mmap(self.sock.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('Not a tastytweets snapshot: %s' % path)
+        trailer = self.data[-TRAILER_SIZE:]
+        offset, length = int(trailer[:20]), int(trailer[20:])
+        meta = json.loads(zlib.decompress(self.data[offset:offset + length]))
+        self.created = meta['created']
+        self.started = meta.get('started', self.created)
+        self.index = meta['responses']
+        self.state = meta['state']
+
+
+
+
+class RecordingTransport(Transport):
+    """
+      
+      Sends each request with ``transport`` and keeps the response, for
+      ``save`` to write to a snapshot file at ``path`` once the run's over,
+      along with the ``state`` it started from and when it ``started``.  Only
+      successful responses are kept.  Safe to share between threads.
+      
+      
+    """
+    
+    def send(self, request):
+        response = self.transport.send(request)
+        body = response.read()
+        response.close()
+        headers = ''.join([
+                line for line in response.info().headers
+                if not line.split(':', 1)[0].strip().lower() in DROP_HEADERS
+            ]
+        )
+        code = getattr(response, 'code', 200)
+        self._lock.acquire()
+        try:
+            self.responses[get_snapshot_key(request)] = (code, headers, zlib.compress(body))
+        finally:
+            self._lock.release()
+        return make_response(request.get_full_url(), code, headers, body)
+    
+    def save(self):
+        self._lock.acquire()
+        try:
+            write_snapshot(self.path, self.responses, self.state, self.started)
+        finally:
+            self._lock.release()
+    
+    def close(self):
+        self.transport.close()
+    
+    
+    def __init__(self, transport, path, state=None, started=None):
+        self.transport = transport
+        self.path = path
+        self.state = state
+        self.started = started or time.time()
+        self.responses = {}
+        self._lock = threading.Lock()
+
+
+
+
+class SnapshotTransport(Transport):
+    """
+      
+      Answers requests from a ``Snapshot``, without going near the network.
+      A request that isn't in the snapshot raises a ``SnapshotMiss`` and its
+      key is added to ``misses``.
+      
+      If given, ``feed_url`` is the url of a delicious feed, with ``%s`` for
+      the user and the ``+`` separated tags (e.g.: ``DELICIOUS_URL``).  A feed
+      that isn't in the snapshot is then made up from one that was saved for
+      fewer of its tags, keeping only the bookmarks tagged with all of them,
+      so a run can be replayed with narrower tags than it was saved with.
+      
+      
+    """
+    
+    def _parse_feed_url(self, url):
+        if self._feed_pattern is None:
+            return None
+        match = self._feed_pattern.match(url)
+        if match is None:
+            return None
+        return match.group(1), set(match.group(2).split('+'))
+    
+    def _narrow_feed(self, key):
+        method, url = key.split(' ', 1)
+        wanted = self._parse_feed_url(url)
+        if wanted is None:
+            return None
+        user, tags = wanted
+        for saved_key in self.snapshot.keys():
+            saved_method, saved_url = saved_key.split(' ', 1)
+            saved = saved_method == method and self._parse_feed_url(saved_url)
+            if saved and saved[0] == user and saved[1] <= tags:
+                code, headers, body = self.snapshot.get(saved_key)
+                bookmarks = [
+                    bookmark for bookmark in json.loads(body)
+                    if tags <= set(bookmark.get('t') or [])
+                ]
+                return code, headers, json.dumps(bookmarks)
+        
+        return None
+    
+    
+    def send(self, request):
+        key = get_snapshot_key(request)
+        entry = self.snapshot.get(key)
+        if entry is None:
+            entry = self._narrow_feed(key)
+        if entry is None:
+            self.misses.append(key)
+            raise SnapshotMiss('Not in the snapshot: %s' % key)
+        code, headers, body = entry
+        return make_response(request.get_full_url(), code, headers, body)
+    
+    def close(self):
+        self.snapshot.close()
+    
+    
+    def __init__(self, snapshot, feed_url=None):
+        self.snapshot = snapshot
+        self.misses = []
+        self._feed_pattern = None
+        if feed_url is not None:
+            parts = [re.escape(part) for part in feed_url.split('%s')]
+            self._feed_pattern = re.compile('^%s$' % '([^/?]+)'.join(parts))
+
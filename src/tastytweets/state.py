@@ -0,0 +1,326 @@
+import os
+import pickle
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import sqlite3
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite3
+
+
+SQLITE_HEADER = 'SQLite format 3\x00'
+
+
+class StateStore(object):
+    """
+      
+      Interface for the persistent state a ``TastyTweeter`` keeps between runs:
+      
+      - named values, like the ``'current'`` (latest seen) tweet id
+      
+      - a ``since_id`` cursor per tagged url
+      
+      - the ids of twitter users with follow requests waiting in the queue
+      
+      - the ids of the twitter users we're following, as far as we know
+      
+      - a dict of metadata per tagged url, which makes up the index of the
+        tagged urls we know about
+      
+      Writes are staged until ``commit`` is called, which applies them all
+      at once, or not at all.  To plug in a different backend, subclass
+      this and pass an instance to the ``TastyTweeter`` as ``state_store``.
+      
+      
+    """
+    
+    def get(self, key, default=None):
+        raise NotImplementedError
+    
+    def set(self, key, value):
+        raise NotImplementedError
+    
+    
+    def get_cursor(self, url, default=None):
+        raise NotImplementedError
+    
+    def set_cursor(self, url, since_id):
+        raise NotImplementedError
+    
+    def get_cursors(self):
+        raise NotImplementedError
+    
+    
+    def has_user(self, user_id):
+        raise NotImplementedError
+    
+    def add_user(self, user_id, username=None):
+        raise NotImplementedError
+    
+    def remove_user(self, user_id):
+        raise NotImplementedError
+    
+    def clear_users(self):
+        raise NotImplementedError
+    
+    
+    def is_following(self, user_id):
+        raise NotImplementedError
+    
+    def add_following(self, user_id):
+        raise NotImplementedError
+    
+    def set_following(self, user_ids):
+        raise NotImplementedError
+    
+    
+    def get_site(self, url):
+        raise NotImplementedError
+    
+    def update_site(self, url, **metadata):
+        raise NotImplementedError
+    
+    def get_sites(self):
+        raise NotImplementedError
+    
+    
+    def commit(self):
+        raise NotImplementedError
+    
+    def reset(self):
+        raise NotImplementedError
+    
+    def reset_cursors(self):
+        raise NotImplementedError
+    
+    def close(self):
+        pass
+
+
+
+
+class SqliteStateStore(StateStore):
+    """
+      
+      ``StateStore`` backed by a SQLite database, so every read is a lookup
+      by key and every ``commit`` is an atomic transaction.
+      
+      
+    """
+    
+    schema = (
+        'CREATE TABLE IF NOT EXISTS vars (key TEXT PRIMARY KEY, value TEXT)',
+        'CREATE TABLE IF NOT EXISTS cursors (url TEXT PRIMARY KEY, since_id INTEGER)',
+        'CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, username TEXT, added REAL)',
+        'CREATE TABLE IF NOT EXISTS following (user_id INTEGER PRIMARY KEY)',
+        'CREATE TABLE IF NOT EXISTS sites (url TEXT PRIMARY KEY, metadata TEXT)'
+    )
+    
+    def _one(self, sql, params):
+        row = self.db.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        return row[0]
+    
+    
+    def get(self, key, default=None):
+        value = self._one('SELECT value FROM vars WHERE key = ?', (key,))
+        if value is None:
+            return default
+        return json.loads(value)
+    
+    def set(self, key, value):
+        self.db.execute(
+            'INSERT OR REPLACE INTO vars (key, value) VALUES (?, ?)',
+            (key, json.dumps(value))
+        )
+    
+    
+    def get_cursor(self, url, default=None):
+        since_id = self._one('SELECT since_id FROM cursors WHERE url = ?', (url,))
+        if since_id is None:
+            return default
+        return since_id
+    
+    def set_cursor(self, url, since_id):
+        self.db.execute(
+            'INSERT OR REPLACE INTO cursors (url, since_id) VALUES (?, ?)',
+            (url, since_id)
+        )
+    
+    def get_cursors(self):
+        return dict(self.db.execute('SELECT url, since_id FROM cursors'))
+    
+    
+    def has_user(self, user_id):
+        sql = 'SELECT 1 FROM users WHERE user_id = ?'
+        return self._one(sql, (user_id,)) is not None
+    
+    def add_user(self, user_id, username=None):
+        self.db.execute(
+            'INSERT OR IGNORE INTO users (user_id, username, added) VALUES (?, ?, ?)',
+            (user_id, username, time.time())
+        )
+    
+    def remove_user(self, user_id):
+        self.db.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+    
+    def clear_users(self):
+        self.db.execute('DELETE FROM users')
+    
+    
+    def is_following(self, user_id):
+        sql = 'SELECT 1 FROM following WHERE user_id = ?'
+        return self._one(sql, (user_id,)) is not None
+    
+    def add_following(self, user_id):
+        self.db.execute('INSERT OR IGNORE INTO following (user_id) VALUES (?)', (user_id,))
+    
+    def set_following(self, user_ids):
+        self.db.execute('DELETE FROM following')
+        self.db.executemany(
+            'INSERT OR IGNORE INTO following (user_id) VALUES (?)',
+            ((user_id,) for user_id in user_ids)
+        )
+    
+    
+    def get_site(self, url):
+        metadata = self._one('SELECT metadata FROM sites WHERE url = ?', (url,))
+        if metadata is None:
+            return {}
+        return json.loads(metadata)
+    
+    def update_site(self, url, **metadata):
+        site = self.get_site(url)
+        site.update(metadata)
+        self.db.execute(
+            'INSERT OR REPLACE INTO sites (url, metadata) VALUES (?, ?)',
+            (url, json.dumps(site))
+        )
+    
+    def get_sites(self):
+        sites = {}
+        for url, metadata in self.db.execute('SELECT url, metadata FROM sites'):
+            sites[url] = json.loads(metadata)
+        return sites
+    
+    
+    def commit(self):
+        self.db.commit()
+    
+    def reset(self):
+        for table in ('vars', 'cursors', 'users', 'following', 'sites'):
+            self.db.execute('DELETE FROM %s' % table)
+        self.db.commit()
+    
+    def reset_cursors(self):
+        """
+          
+          Forgets where each url's search got to, so they're all searched
+          from the start again, but keeps the index of urls (bar their
+          backlogs and when they're next due), the users and who we follow.
+          
+          
+        """
+        self.db.execute('DELETE FROM cursors')
+        self.db.execute("DELETE FROM vars WHERE key IN ('current', 'default')")
+        for url, site in self.get_sites().items():
+            if 'backlog' in site or 'next_check' in site:
+                site.pop('backlog', None)
+                site.pop('next_check', None)
+                self.db.execute(
+                    'UPDATE sites SET metadata = ? WHERE url = ?',
+                    (json.dumps(site), url)
+                )
+            
+        self.db.commit()
+    
+    def close(self):
+        self.db.close()
+    
+    
+    def dump(self):
+        """
+          
+          Returns the state as a list of sql statements, which ``load`` fills
+          another store with, e.g.: to work on a copy of it in memory::
+              
+              >>> copy = SqliteStateStore(':memory:')
+              >>> copy.load(store.dump())
+          
+          
+        """
+        return [sql for sql in self.db.iterdump() if sql.startswith('INSERT')]
+    
+    def load(self, statements):
+        for sql in statements:
+            self.db.execute(sql)
+        self.db.commit()
+    
+    
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        for sql in self.schema:
+            self.db.execute(sql)
+        self.db.commit()
+
+
+
+
+def is_sqlite_file(path):
+    sock = open(path, 'rb')
+    header = sock.read(len(SQLITE_HEADER))
+    sock.close()
+    return not header or header == SQLITE_HEADER
+
+
+def migrate_pickle(store, path):
+    """
+      
+      Copies the status data out of a pickle file, as written by previous
+      versions, into ``store`` and commits it.
+      
+      
+    """
+    sock = open(path, 'rb')
+    status_ids = pickle.load(sock)
+    sock.close()
+    current = status_ids.get('current') or 0
+    store.set('current', current)
+    # before we kept a status id per url there was just the global one,
+    # which is where any url we haven't seen since should start from
+    store.set('default', status_ids.get('default', current))
+    for url, since_id in status_ids.get('sites', {}).iteritems():
+        store.set_cursor(url, since_id)
+    store.commit()
+
+
+def open_state_store(path, legacy_path=None):
+    """
+      
+      Opens the ``SqliteStateStore`` at ``path``, migrating the old pickle
+      status data if need be.  That's either ``path`` itself, if it's a
+      pickle file, or ``legacy_path`` if there's no database at ``path`` yet.
+      Migrated pickle files are kept, renamed with a ``.migrated`` suffix.
+      
+      
+    """
+    migrate_from = None
+    if os.path.exists(path):
+        if not is_sqlite_file(path):
+            migrate_from = '%s.migrated' % path
+            os.rename(path, migrate_from)
+    elif legacy_path and os.path.exists(legacy_path):
+        migrate_from = legacy_path
+    store = SqliteStateStore(path)
+    if migrate_from is not None:
+        migrate_pickle(store, migrate_from)
+        if migrate_from == legacy_path:
+            os.rename(legacy_path, '%s.migrated' % legacy_path)
+    return store
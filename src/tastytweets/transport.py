@@ -0,0 +1,253 @@
+import httplib
+import socket
+import threading
+import urllib2
+import urlparse
+import zlib
+
+from StringIO import StringIO
+
+
+CONNECT_TIMEOUT = 10 # seconds
+READ_TIMEOUT = 30 # seconds
+
+MAX_IDLE = 4 # idle connections kept open per host
+MAX_REDIRECTS = 5
+
+# requests it's safe to send again if a reused connection drops them
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+CHUNK_SIZE = 16 * 1024
+
+
+class Transport(object):
+    """
+      
+      Sends the ``urllib2.Request``s a ``TastyTweeter`` makes.  ``send`` returns
+      a file like object with the response body, as ``urllib2.urlopen`` does,
+      and raises an ``IOError`` (i.e.: a ``urllib2.URLError`` or, for error
+      responses, a ``urllib2.HTTPError``) if the request fails.
+      
+      To swap in a different transport (a fake one, say, in tests), subclass
+      this and pass an instance to the ``TastyTweeter`` as ``transport``.
+      
+      
+    """
+    
+    def send(self, request):
+        raise NotImplementedError
+    
+    def close(self):
+        pass
+
+
+
+
+class Response(object):
+    """
+      
+      File like body of an http response, gunzipped on the fly if need be.
+      The connection goes back in the pool once the body has been read to the
+      end, or is closed if the response is closed before then.  If reading
+      the body fails, a ``urllib2.URLError`` is raised.
+      
+      
+    """
+    
+    def _read_chunk(self):
+        while self._response is not None:
+            try:
+                data = self._response.read(CHUNK_SIZE)
+            except (socket.error, httplib.HTTPException), e:
+                # we don't know how much of the body is left on the wire, so
+                # the connection can't be used again
+                self._finish(reuse=False)
+                raise urllib2.URLError(e)
+            if not data:
+                if self._decompressor is not None:
+                    data = self._decompressor.flush()
+                self._finish(reuse=not self._response.will_close)
+                return data
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            if data:
+                return data
+        
+        return ''
+    
+    def _finish(self, reuse):
+        self._release(self._connection, reuse)
+        self._response = None
+        self._connection = None
+    
+    
+    def info(self):
+        return self.headers
+    
+    def geturl(self):
+        return self.url
+    
+    def getcode(self):
+        return self.code
+    
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self._buffer]
+            chunk = self._read_chunk()
+            while chunk:
+                chunks.append(chunk)
+                chunk = self._read_chunk()
+            self._buffer = ''
+            return ''.join(chunks)
+        while len(self._buffer) < size:
+            chunk = self._read_chunk()
+            if not chunk:
+                break
+            self._buffer += chunk
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+    
+    def close(self):
+        if self._response is not None:
+            # the rest of the body is still on the wire, so the
+            # connection can't be used again
+            self._finish(reuse=False)
+    
+    
+    def __init__(self, url, response, connection, release):
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+        self._response = response
+        self._connection = connection
+        self._release = release
+        self._buffer = ''
+        self._decompressor = None
+        if response.getheader('content-encoding', '').lower() == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+
+
+class HTTPTransport(Transport):
+    """
+      
+      Keeps a pool of keep-alive connections per host, so a run doesn't pay
+      for a new connection (and, for twitter, a new TLS handshake) on every
+      request.  Asks for gzipped responses and has separate ``connect_timeout``
+      and ``read_timeout``s (in seconds), so a hung socket can't stall a run.
+      Safe to share between threads.
+      
+      
+    """
+    
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection
+    }
+    
+    def _get_connection(self, key):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        finally:
+            self._lock.release()
+        scheme, host, port = key
+        connection_class = self.connection_classes[scheme]
+        connection = connection_class(host, port, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+    
+    def _release(self, key, connection, reuse):
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if reuse and len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+    
+    
+    def _open(self, url, method, data, headers):
+        parts = urlparse.urlsplit(url)
+        if not parts.scheme in self.connection_classes:
+            raise urllib2.URLError('unknown url type: %s' % parts.scheme)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % (path, parts.query)
+        while True:
+            try:
+                connection, reused = self._get_connection(key)
+            except (socket.error, httplib.HTTPException), e:
+                raise urllib2.URLError(e)
+            try:
+                connection.request(method, path, data, headers)
+                response = connection.getresponse()
+            except (socket.error, httplib.HTTPException), e:
+                connection.close()
+                # the server may well have dropped an idle connection,
+                # in which case we try again with a new one, unless the
+                # server might have acted on the request before it went
+                # (e.g.: a follow), so sending it again would repeat it
+                if reused and method in IDEMPOTENT_METHODS and not isinstance(e, socket.timeout):
+                    continue
+                raise urllib2.URLError(e)
+            release = lambda connection, reuse: self._release(key, connection, reuse)
+            return Response(url, response, connection, release)
+    
+    
+    def send(self, request):
+        url = request.get_full_url()
+        method = request.get_method()
+        data = request.get_data()
+        headers = dict(request.header_items())
+        headers.setdefault('Accept-Encoding', 'gzip')
+        if data is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        for i in range(self.max_redirects + 1):
+            response = self._open(url, method, data, headers)
+            location = response.headers.getheader('location')
+            if not (response.code in (301, 302, 303, 307) and location):
+                break
+            response.read()
+            url = urlparse.urljoin(url, location)
+            # as urllib2 does, redirects are followed with a GET
+            if response.code != 307:
+                method = 'GET'
+                data = None
+                headers.pop('Content-Type', None)
+        
+        if response.code >= 300:
+            body = StringIO(response.read())
+            raise urllib2.HTTPError(url, response.code, response.msg, response.headers, body)
+        return response
+    
+    def close(self):
+        self._lock.acquire()
+        try:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            
+            self._idle = {}
+        finally:
+            self._lock.release()
+    
+    
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_idle=MAX_IDLE, max_redirects=MAX_REDIRECTS):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+        self._idle = {}
+        self._lock = threading.Lock()
+